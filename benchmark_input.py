@@ -0,0 +1,43 @@
+import json
+import tensorflow as tf
+from utils import benchmark_input_pipeline
+
+"""
+Configuration Part.
+"""
+# Parameters
+tf.app.flags.DEFINE_string("txt_file", './data/train.txt', "the manifest, or the shard index of a tfrecord source")
+tf.app.flags.DEFINE_string("source", 'text', "text or tfrecord(default:text)")
+tf.app.flags.DEFINE_integer("img_out_size", 224, "img_out_size(default:224)")
+tf.app.flags.DEFINE_integer("batch_size", 128, "batch_size(default:128)")
+tf.app.flags.DEFINE_integer("num_batches", 20, "batches timed per stage(default:20)")
+tf.app.flags.DEFINE_integer("num_parallel_calls", 20, "map parallelism(default:20)")
+tf.app.flags.DEFINE_integer("prefetch", 1, "prefetched batches(default:1)")
+tf.app.flags.DEFINE_integer("cycle_length", 8, "tfrecord shards read at once(default:8)")
+tf.app.flags.DEFINE_boolean("autotune", False, "tune the pipeline config first instead of using the flags above(default:False)")
+tf.app.flags.DEFINE_string("output_file", '', "also write the report to this file(default: only print it)")
+FLAGS = tf.app.flags.FLAGS
+
+"""
+Time the input pipeline alone, without a model, and print a JSON report.
+A finetune run is input bound when its steps/sec * batch_size comes close to the images_per_sec.
+"""
+if FLAGS.autotune:
+    pipeline_config = 'autotune'
+else:
+    pipeline_config = {'num_parallel_calls': FLAGS.num_parallel_calls,
+                       'prefetch': FLAGS.prefetch,
+                       'cycle_length': FLAGS.cycle_length}
+
+report = benchmark_input_pipeline(txt_file=FLAGS.txt_file,
+                                  source=FLAGS.source,
+                                  img_out_size=FLAGS.img_out_size,
+                                  batch_size=FLAGS.batch_size,
+                                  num_batches=FLAGS.num_batches,
+                                  pipeline_config=pipeline_config
+                                  )
+print(json.dumps(report, indent=2))
+
+if FLAGS.output_file:
+    with open(FLAGS.output_file, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,44 @@
+import sys
+import json
+import subprocess
+import numpy as np
+import tensorflow as tf
+
+"""
+Configuration Part.
+"""
+# Parameters
+tf.app.flags.DEFINE_string("modules", 'tensorflow,utils,nets.nets_factory,model_resnetv1_50,model_inceptionv3', "comma separated modules to time the import of")
+tf.app.flags.DEFINE_integer("repeats", 5, "fresh interpreters per module(default:5)")
+tf.app.flags.DEFINE_string("output_file", '', "also write the report to this file(default: only print it)")
+FLAGS = tf.app.flags.FLAGS
+
+# prints the seconds the import of a module takes, after importing the given modules first
+TIMING_CODE = "import time\n{}\nstart = time.time()\nimport {}\nprint(time.time() - start)"
+
+"""
+Time the imports of short lived jobs, each in fresh interpreters, and print a JSON report.
+'seconds' is the import on a cold interpreter, 'after_tensorflow_seconds' what the module costs on top of TensorFlow,
+which every job imports anyway.
+"""
+
+
+def time_import(module, preload=''):
+    """Median seconds of importing `module` in fresh interpreters, after importing `preload`."""
+    timings = []
+    for _ in range(FLAGS.repeats):
+        code = TIMING_CODE.format("import {}".format(preload) if preload else "", module)
+        timings.append(float(subprocess.check_output([sys.executable, "-c", code]).decode("utf-8").split()[-1]))
+    return float(np.median(timings))
+
+
+report = {'python': sys.version.split()[0], 'tensorflow': tf.__version__, 'repeats': FLAGS.repeats, 'modules': {}}
+for module in FLAGS.modules.split(','):
+    report['modules'][module] = {'seconds': time_import(module)}
+    if module != 'tensorflow':
+        report['modules'][module]['after_tensorflow_seconds'] = time_import(module, preload='tensorflow')
+print(json.dumps(report, indent=2))
+
+if FLAGS.output_file:
+    with open(FLAGS.output_file, 'w') as f:
+        json.dump(report, f, indent=2)
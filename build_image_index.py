@@ -0,0 +1,22 @@
+import tensorflow as tf
+from utils import build_image_index
+
+"""
+Configuration Part.
+"""
+# Parameters
+tf.app.flags.DEFINE_string("train_file", './data/train.txt', "the path of train data")
+tf.app.flags.DEFINE_string("val_file", './data/validation.txt', "the path of val data")
+tf.app.flags.DEFINE_integer("num_workers", 0, "scanning processes(default: one per cpu)")
+FLAGS = tf.app.flags.FLAGS
+
+"""
+Validate every image of the train and validation manifests once and index their format, size and bytes.
+ImageDataGenerator, and so every finetune and test script, picks the index of its manifest up by itself and drops unusable images up front.
+Editing a manifest invalidates its index, run this again then.
+"""
+for txt_file in [FLAGS.train_file, FLAGS.val_file]:
+    index_path = build_image_index(txt_file=txt_file,
+                                   num_workers=FLAGS.num_workers or None
+                                   )
+    print("Image index: {}\n".format(index_path))
@@ -0,0 +1,27 @@
+import tensorflow as tf
+from utils import build_resized_store
+
+"""
+Configuration Part.
+"""
+# Parameters
+tf.app.flags.DEFINE_string("train_file", './data/train.txt', "the path of train data")
+tf.app.flags.DEFINE_string("val_file", './data/validation.txt', "the path of val data")
+tf.app.flags.DEFINE_string("test_file", './data/test.txt', "the path of test data")
+tf.app.flags.DEFINE_string("store_dir", './data/resized', "the directory the resized images are written to")
+tf.app.flags.DEFINE_string("sizes", '224,299', "comma separated default_image_size of the models(default: 224 for vgg, resnet, inception v1/v2, densenet and 299 for inception v3/v4)")
+tf.app.flags.DEFINE_integer("num_workers", 0, "scanning processes(default: one per cpu)")
+FLAGS = tf.app.flags.FLAGS
+
+"""
+Write the images of the manifests resized to every model input size, with the ops of the input pipeline, as PNG.
+The finetune and test scripts read them instead of the originals when passed the same store_dir.
+"""
+for txt_file in [FLAGS.train_file, FLAGS.val_file, FLAGS.test_file]:
+    for img_out_size in [int(size) for size in FLAGS.sizes.split(',')]:
+        manifest_path = build_resized_store(txt_file=txt_file,
+                                            store_dir=FLAGS.store_dir,
+                                            img_out_size=img_out_size,
+                                            num_workers=FLAGS.num_workers or None
+                                            )
+        print("Resized manifest: {}\n".format(manifest_path))
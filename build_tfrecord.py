@@ -0,0 +1,24 @@
+import tensorflow as tf
+from utils import convert_to_tfrecord
+
+"""
+Configuration Part.
+"""
+# Parameters
+tf.app.flags.DEFINE_string("train_file", './data/train.txt', "the path of train data")
+tf.app.flags.DEFINE_string("val_file", './data/validation.txt', "the path of val data")
+tf.app.flags.DEFINE_string("output_dir", './data/tfrecord', "the directory the shards are written to")
+tf.app.flags.DEFINE_integer("num_shards", 8, "num_shards per manifest(default:8)")
+FLAGS = tf.app.flags.FLAGS
+
+"""
+Pack the train and validation manifests into sharded TFRecord files.
+Pass the printed index files as `txt_file` to ImageDataGenerator with source='tfrecord'.
+"""
+for txt_file in [FLAGS.train_file, FLAGS.val_file]:
+    index_path = convert_to_tfrecord(txt_file=txt_file,
+                                     output_dir=FLAGS.output_dir,
+                                     num_shards=FLAGS.num_shards,
+                                     shuffle=True
+                                     )
+    print("Shard index: {}\n".format(index_path))
@@ -0,0 +1,24 @@
+import tensorflow as tf
+from utils import convert_checkpoint_weights
+
+"""
+Configuration Part.
+"""
+# Parameters
+tf.app.flags.DEFINE_string("checkpoint_path", './pre_trained_models/vgg_16.ckpt', "the path of the pretrained checkpoint(V1 checkpoints, like the downloaded ones, load sequentially without a weight file)")
+tf.app.flags.DEFINE_string("output_path", '', "the path of the weight file(default: next to the checkpoint, with the extension .weights)")
+tf.app.flags.DEFINE_string("storage_dtype", 'float32', "float32, or float16 or bfloat16 to store the float weights in half the size(default:float32)")
+FLAGS = tf.app.flags.FLAGS
+
+"""
+Convert a pretrained checkpoint into a flat, memory-mapped weight file.
+Pass it as `weights_path` to a model, whose load_initial_weights then reads it instead of the checkpoint.
+The pretrained checkpoints this repo downloads are V1 checkpoints. Those are never memory-mapped and their
+tensors are not read by the thread pool: load_initial_weights reads them one chunk of variables after the other.
+Only V2 checkpoints (with the crc32c package installed, to verify them) and weight files are memory-mapped.
+"""
+weights_path = convert_checkpoint_weights(checkpoint_path=FLAGS.checkpoint_path,
+                                          output_path=FLAGS.output_path or None,
+                                          storage_dtype=FLAGS.storage_dtype
+                                          )
+print("Weight file: {}\n".format(weights_path))
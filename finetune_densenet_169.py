@@ -6,7 +6,13 @@ import tensorflow as tf
 from nets import densenet
 from model_densenet_169 import DenseNet_169
 from utils import ImageDataGenerator
+from utils import InputMonitor
 from utils import download_ckpt
+from utils import feedable_iterator
+from utils import load_input_state
+from utils import parse_resolution_schedule
+from utils import resolution_stage
+from utils import save_input_state
 
 os.environ['CUDA_VISIBLE_DEVICES'] = '0,1,2,3'
 
@@ -23,45 +29,76 @@ tf.app.flags.DEFINE_integer("num_classes", 5, "num_classes(default:2)")
 tf.app.flags.DEFINE_integer("evaluate_every", 200, "Evaluate model on dev set after this many steps (default: 100)")
 tf.app.flags.DEFINE_integer("checkpoint_every", 400, "Save model after this many steps (default: 100)")
 tf.app.flags.DEFINE_integer("num_checkpoints", 3, "num_checkpoints(default:3)")
+tf.app.flags.DEFINE_string("resume_dir", '', "the run directory to resume training from(default: start a new run)")
+tf.app.flags.DEFINE_string("store_dir", './data/resized', "the directory of the resized images of build_resized_store.py, if built")
+tf.app.flags.DEFINE_string("stats_file", '', "the dataset statistics of compute_dataset_stats to subtract the mean of(default: the ImageNet mean)")
+tf.app.flags.DEFINE_string("resolution_schedule", '', "train at growing image sizes, as step:size pairs, e.g. '0:128,400:160,800:224'(default: default_image_size only)")
+tf.app.flags.DEFINE_boolean("augment", False, "augment the training images with random crops, flips and color jitter(default:False)")
+tf.app.flags.DEFINE_integer("input_stats_every", 100, "Report how long the train steps waited for data after this many steps (default: 100)")
+tf.app.flags.DEFINE_float("input_bound_threshold", 0.2, "Flag the train steps as input bound above this fraction of time waiting for data(default:0.2)")
 FLAGS = tf.app.flags.FLAGS
-num_validation = 10000
 train_layers = ["logits"]
 
 
 """
 Main Part of the finetuning Script.
 """
+# Continue the data order of an interrupted run at the sample it stopped at
+if FLAGS.resume_dir:
+    resume_checkpoint = tf.train.latest_checkpoint(os.path.join(FLAGS.resume_dir, "ckpt"))
+    seed, start_position = load_input_state(resume_checkpoint)
+else:
+    seed, start_position = np.random.randint(2 ** 31 - 1), 0
+resolution_schedule = parse_resolution_schedule(FLAGS.resolution_schedule, default_size=densenet.densenet169.default_image_size)
+
 # Load data on the cpu
 print("Loading data...")
 with tf.device('/cpu:0'):
-    train_iterator = ImageDataGenerator(txt_file=FLAGS.train_file,
-                                        mode='training',
-                                        batch_size=FLAGS.batch_size,
-                                        num_classes=FLAGS.num_classes,
-                                        shuffle=True,
-                                        img_out_size=densenet.densenet169.default_image_size
-                                        )
+    # one training pipeline per resolution, each starting at the first sample of its stage
+    train_iterators = []
+    for first_step, img_out_size in resolution_schedule:
+        train_iterators.append(ImageDataGenerator(txt_file=FLAGS.train_file,
+                                                  mode='training',
+                                                  batch_size=FLAGS.batch_size,
+                                                  num_classes=FLAGS.num_classes,
+                                                  shuffle=True,
+                                                  img_out_size=img_out_size,
+                                                  transport='uint8',
+                                                  store_dir=FLAGS.store_dir,
+                                                  mean=FLAGS.stats_file or None,
+                                                  full_shuffle=True,
+                                                  augment=FLAGS.augment,
+                                                  monitor=True,
+                                                  seed=seed,
+                                                  start_position=max(start_position, first_step * FLAGS.batch_size)
+                                                  ))
 
     val_iterator = ImageDataGenerator(txt_file=FLAGS.val_file,
                                       mode='inference',
                                       batch_size=FLAGS.batch_size,
                                       num_classes=FLAGS.num_classes,
                                       shuffle=False,
-                                      img_out_size=densenet.densenet169.default_image_size
+                                      img_out_size=densenet.densenet169.default_image_size,
+                                      transport='uint8',
+                                      store_dir=FLAGS.store_dir,
+                                      mean=FLAGS.stats_file or None,
+                                      repeat=False
                                       )
 
-    train_next_batch = train_iterator.iterator.get_next()
-    val_next_batch = val_iterator.iterator.get_next()
+    # the model reads the batches of the iterator whose string handle is fed
+    handle, next_batch = feedable_iterator(train_iterators[0].iterator, variable_size=True)
 
 
 # Initialize model
 densenet_169 = DenseNet_169(num_classes=FLAGS.num_classes,
-                            train_layers=train_layers
+                            train_layers=train_layers,
+                            inputs=next_batch,
+                            mean=train_iterators[0].mean
                             )
 
 with tf.Session() as sess:
     timestamp = str(int(time.time()))
-    out_dir = os.path.abspath(os.path.join(os.path.curdir, "runs", "densenet_169", timestamp))
+    out_dir = os.path.abspath(FLAGS.resume_dir or os.path.join(os.path.curdir, "runs", "densenet_169", timestamp))
     print("Writing to {}\n".format(out_dir))
 
     # define summary
@@ -91,56 +128,70 @@ with tf.Session() as sess:
     saver = tf.train.Saver(tf.global_variables(), max_to_keep=FLAGS.num_checkpoints)
 
     sess.run(tf.global_variables_initializer())
-
-    # Load the pre_trained weights into the non-trainable layer
-    if "densenet_169.ckpt" not in os.listdir("./pre_trained_models/"):
-        print("didn't find the .ckpt pre_trained_model in the directory './pre_trained_models/'")
-        exit()
-
-    densenet_169.load_initial_weights(sess)
+    train_handles = sess.run([train_iterator.iterator.string_handle() for train_iterator in train_iterators])
+    val_handle = sess.run(val_iterator.iterator.string_handle())
+
+    if FLAGS.resume_dir:
+        saver.restore(sess, resume_checkpoint)
+        # keep rotating the checkpoints of the interrupted run
+        saver.recover_last_checkpoints(tf.train.get_checkpoint_state(checkpoint_dir).all_model_checkpoint_paths)
+        print("Resumed from {} at sample {}\n".format(resume_checkpoint, start_position))
+    else:
+        # Load the pre_trained weights into the non-trainable layer
+        if "densenet_169.ckpt" not in os.listdir("./pre_trained_models/"):
+            print("didn't find the .ckpt pre_trained_model in the directory './pre_trained_models/'")
+            exit()
+
+        load_report = densenet_169.load_initial_weights(sess)
+        print("pretrained variables loaded: {}, skipped (train_layers): {}, missing in the model: {}, shape mismatches: {}"
+              .format(*[len(load_report[key]) for key in ['loaded', 'skipped_train_layers', 'missing', 'shape_mismatch']]))
+    current_step = sess.run(densenet_169.global_step)
     print("run the tensorboard in terminal: \ntensorboard --logdir={} --port=6006 \n".format(out_dir))
 
+    input_monitor = InputMonitor(input_bound_threshold=FLAGS.input_bound_threshold)
     while True:
         step = 0
         # train loop
-        x_batch_train, y_batch_train = sess.run(train_next_batch)
-        _, step, train_summaries, loss, accuracy = sess.run([densenet_169.train_op, densenet_169.global_step, train_summary_merged, densenet_169.loss, densenet_169.accuracy],
-                                                            feed_dict={
-                                                                densenet_169.x_input: x_batch_train,
-                                                                densenet_169.y_input: y_batch_train,
-                                                                densenet_169.learning_rate: FLAGS.learning_rate
-                                                            })
+        stage = resolution_stage(resolution_schedule, current_step)
+        _, step, train_summaries, loss, accuracy = input_monitor.run(sess, train_iterators[stage], [densenet_169.train_op, densenet_169.train_step, train_summary_merged, densenet_169.loss, densenet_169.accuracy],
+                                                                     feed_dict={
+                                                                         handle: train_handles[stage],
+                                                                         densenet_169.learning_rate: FLAGS.learning_rate
+                                                                     })
         train_summary_writer.add_summary(train_summaries, step)
         time_str = datetime.datetime.now().isoformat()
         print("{}: step: {}, loss: {:g}, acc: {:g}".format(time_str, step, loss, accuracy))
 
         # validation
-        current_step = tf.train.global_step(sess, densenet_169.global_step)
+        current_step = step
+
+        if current_step % FLAGS.input_stats_every == 0:
+            input_monitor.report(train_summary_writer, current_step)
 
         if current_step % FLAGS.evaluate_every == 0:
             print("\nEvaluation:")
-            # num_batches in one validation
-            num_batchs_one_validation = int(num_validation / FLAGS.batch_size)
+            # one pass over the whole validation set, including the last partial batch
+            sess.run(val_iterator.iterator.initializer)
             loss_list = []
             acc_list = []
+            size_list = []
 
-            for i in range(num_batchs_one_validation):
-
-                x_batch_val, y_batch_val = sess.run(val_next_batch)
+            for i in range(val_iterator.num_batches):
                 step, dev_summaries, loss, accuracy = sess.run([densenet_169.global_step, val_summary_merged, densenet_169.loss_val, densenet_169.accuracy],
                                                                feed_dict={
-                                                                   densenet_169.x_input: x_batch_val,
-                                                                   densenet_169.y_input: y_batch_val,
+                                                                   handle: val_handle,
                                                                })
                 loss_list.append(loss)
                 acc_list.append(accuracy)
+                size_list.append(min(FLAGS.batch_size, val_iterator.data_size - i * FLAGS.batch_size))
                 val_summary_writer.add_summary(dev_summaries, step)
             time_str = datetime.datetime.now().isoformat()
-            print("{}: step: {}, loss: {:g}, acc: {:g}".format(time_str, step, np.mean(loss_list), np.mean(acc_list)))
+            print("{}: step: {}, loss: {:g}, acc: {:g}".format(time_str, step, np.average(loss_list, weights=size_list), np.average(acc_list, weights=size_list)))
             print("\n")
 
         if current_step % FLAGS.checkpoint_every == 0:
             path = saver.save(sess, checkpoint_prefix, global_step=current_step)
+            save_input_state(path, seed, current_step * FLAGS.batch_size, saver.last_checkpoints)
             print("Saved model checkpoint to {}\n".format(path))
 
         step += 1
@@ -1,13 +1,22 @@
 import tensorflow as tf
 from nets import densenet
 from utils import _load_initial_weights
+from utils import _initial_weights_restore_ops
+from utils import _normalize_images
 from tensorflow.contrib.slim import arg_scope
 
 
 class DenseNet_161(object):
-    def __init__(self, num_classes, train_layers=None, weights_path='DEFAULT'):
+    def __init__(self, num_classes, train_layers=None, weights_path='DEFAULT', uint8_input=False, inputs=None, mean=None):
 
         """Create the graph of the densenet_161 model.
+        With uint8_input, x_input takes uint8 images and the mean is subtracted in the graph.
+        inputs: optional (images, labels) tensors, e.g. the next batch of an iterator, used instead
+        of the x_input/y_input placeholders so no batch has to go through feed_dict.
+        mean: the per-channel mean subtracted from uint8 images, e.g. the `mean` of the
+        ImageDataGenerator (default: IMAGENET_MEAN).
+        weights_path: a checkpoint, or a flat weight file of convert_weights.py (default: the pretrained
+        checkpoint).
         """
 
         # Parse input arguments into class variables
@@ -19,13 +28,21 @@ class DenseNet_161(object):
 
         with tf.variable_scope("input"):
             self.image_size = densenet.densenet161.default_image_size
-            self.x_input = tf.placeholder(tf.float32, [None, self.image_size, self.image_size, 3], name="x_input")
-            self.y_input = tf.placeholder(tf.float32, [None, num_classes], name="y_input")
+            if inputs is not None:
+                self.x_input, self.y_input = inputs
+            else:
+                input_dtype = tf.uint8 if uint8_input else tf.float32
+                self.x_input = tf.placeholder(input_dtype, [None, self.image_size, self.image_size, 3], name="x_input")
+                self.y_input = tf.placeholder(tf.float32, [None, num_classes], name="y_input")
+            if self.x_input.dtype == tf.uint8:
+                self.images = _normalize_images(self.x_input, mean)
+            else:
+                self.images = self.x_input
             self.learning_rate = tf.placeholder(tf.float32, name="learning_rate")
 
         # train
         with arg_scope(densenet.densenet_arg_scope()):
-            self.logits, _ = densenet.densenet161(self.x_input,
+            self.logits, _ = densenet.densenet161(self.images,
                                                   num_classes=num_classes,
                                                   is_training=True,
                                                   reuse=tf.AUTO_REUSE
@@ -33,7 +50,7 @@ class DenseNet_161(object):
 
         # validation
         with arg_scope(densenet.densenet_arg_scope()):
-            self.logits_val, _ = densenet.densenet161(self.x_input,
+            self.logits_val, _ = densenet.densenet161(self.images,
                                                       num_classes=num_classes,
                                                       is_training=False,
                                                       reuse=tf.AUTO_REUSE,
@@ -56,6 +73,10 @@ class DenseNet_161(object):
             with tf.control_dependencies(update_ops):
                 self.train_op = optimizer.apply_gradients(grads_and_vars=self.grads_and_vars, global_step=self.global_step)
 
+            # the step count after train_op, so both can be fetched in one session call
+            with tf.control_dependencies([self.train_op]):
+                self.train_step = self.global_step.read_value()
+
         with tf.name_scope("probability"):
             self.probability = tf.nn.softmax(self.logits_val, name="probability")
 
@@ -66,7 +87,11 @@ class DenseNet_161(object):
             correct_prediction = tf.equal(self.prediction, tf.argmax(self.y_input, 1))
             self.accuracy = tf.reduce_mean(tf.cast(correct_prediction, "float"), name="accuracy")
 
+        # the ops that load the pretrained weights, built once so loading adds nothing to the graph
+        self.restore_ops = _initial_weights_restore_ops(self.train_layers)
+
     def load_initial_weights(self, session):
-        _load_initial_weights(session=session,
-                              weightPath=self.WEIGHTS_PATH,
-                              train_layers=self.train_layers)
+        return _load_initial_weights(session=session,
+                                     weightPath=self.WEIGHTS_PATH,
+                                     train_layers=self.train_layers,
+                                     restore_ops=self.restore_ops)
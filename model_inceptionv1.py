@@ -1,13 +1,22 @@
 import tensorflow as tf
 from nets import inception
 from utils import _load_initial_weights
+from utils import _initial_weights_restore_ops
+from utils import _normalize_images
 from tensorflow.contrib.slim import arg_scope
 
 
 class InceptionV1(object):
-    def __init__(self, num_classes, train_layers=None, weights_path='DEFAULT'):
+    def __init__(self, num_classes, train_layers=None, weights_path='DEFAULT', uint8_input=False, inputs=None, mean=None):
 
         """Create the graph of the inceptionv1 model.
+        With uint8_input, x_input takes uint8 images and the mean is subtracted in the graph.
+        inputs: optional (images, labels) tensors, e.g. the next batch of an iterator, used instead
+        of the x_input/y_input placeholders so no batch has to go through feed_dict.
+        mean: the per-channel mean subtracted from uint8 images, e.g. the `mean` of the
+        ImageDataGenerator (default: IMAGENET_MEAN).
+        weights_path: a checkpoint, or a flat weight file of convert_weights.py (default: the pretrained
+        checkpoint).
         """
 
         # Parse input arguments into class variables
@@ -19,25 +28,35 @@ class InceptionV1(object):
 
         with tf.variable_scope("input"):
             self.image_size = inception.inception_v1.default_image_size
-            self.x_input = tf.placeholder(tf.float32, [None, self.image_size, self.image_size, 3], name="x_input")
-            self.y_input = tf.placeholder(tf.float32, [None, num_classes], name="y_input")
+            if inputs is not None:
+                self.x_input, self.y_input = inputs
+            else:
+                input_dtype = tf.uint8 if uint8_input else tf.float32
+                self.x_input = tf.placeholder(input_dtype, [None, self.image_size, self.image_size, 3], name="x_input")
+                self.y_input = tf.placeholder(tf.float32, [None, num_classes], name="y_input")
+            if self.x_input.dtype == tf.uint8:
+                self.images = _normalize_images(self.x_input, mean)
+            else:
+                self.images = self.x_input
             self.learning_rate = tf.placeholder(tf.float32, name="learning_rate")
             self.keep_prob = tf.placeholder(tf.float32, name="keep_prob")
 
         # train
         with arg_scope(inception.inception_v1_arg_scope()):
-            self.logits, _ = inception.inception_v1(self.x_input,
+            self.logits, _ = inception.inception_v1(self.images,
                                                     num_classes=num_classes,
                                                     is_training=True,
                                                     reuse=tf.AUTO_REUSE,
+                                                    global_pool=True,
                                                     dropout_keep_prob=self.keep_prob)
 
         # validation
         with arg_scope(inception.inception_v1_arg_scope()):
-            self.logits_val, _ = inception.inception_v1(self.x_input,
+            self.logits_val, _ = inception.inception_v1(self.images,
                                                         num_classes=num_classes,
                                                         is_training=False,
                                                         reuse=tf.AUTO_REUSE,
+                                                        global_pool=True,
                                                         dropout_keep_prob=self.keep_prob
                                                         )
 
@@ -58,6 +77,10 @@ class InceptionV1(object):
             with tf.control_dependencies(update_ops):
                 self.train_op = optimizer.apply_gradients(grads_and_vars=self.grads_and_vars, global_step=self.global_step)
 
+            # the step count after train_op, so both can be fetched in one session call
+            with tf.control_dependencies([self.train_op]):
+                self.train_step = self.global_step.read_value()
+
         with tf.name_scope("probability"):
             self.probability = tf.nn.softmax(self.logits_val, name="probability")
 
@@ -68,7 +91,11 @@ class InceptionV1(object):
             correct_prediction = tf.equal(self.prediction, tf.argmax(self.y_input, 1))
             self.accuracy = tf.reduce_mean(tf.cast(correct_prediction, "float"), name="accuracy")
 
+        # the ops that load the pretrained weights, built once so loading adds nothing to the graph
+        self.restore_ops = _initial_weights_restore_ops(self.train_layers)
+
     def load_initial_weights(self, session):
-        _load_initial_weights(session=session,
-                              weightPath=self.WEIGHTS_PATH,
-                              train_layers=self.train_layers)
+        return _load_initial_weights(session=session,
+                                     weightPath=self.WEIGHTS_PATH,
+                                     train_layers=self.train_layers,
+                                     restore_ops=self.restore_ops)
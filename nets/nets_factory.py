@@ -18,98 +18,113 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import functools
+import importlib
 
 import tensorflow as tf
 
-from nets import alexnet
-from nets import cifarnet
-from nets import inception
-from nets import lenet
-from nets import mobilenet_v1
-from nets import overfeat
-from nets import resnet_v1
-from nets import resnet_v2
-from nets import vgg
-from nets.mobilenet import mobilenet_v2
-from nets.nasnet import nasnet
-from nets.nasnet import pnasnet
-from nets import densenet
+try:
+  from collections.abc import Mapping
+except ImportError:
+  from collections import Mapping
 
 slim = tf.contrib.slim
 
-networks_map = {'alexnet_v2': alexnet.alexnet_v2,
-                'cifarnet': cifarnet.cifarnet,
-                'overfeat': overfeat.overfeat,
-                'vgg_a': vgg.vgg_a,
-                'vgg_16': vgg.vgg_16,
-                'vgg_19': vgg.vgg_19,
-                'inception_v1': inception.inception_v1,
-                'inception_v2': inception.inception_v2,
-                'inception_v3': inception.inception_v3,
-                'inception_v4': inception.inception_v4,
-                'inception_resnet_v2': inception.inception_resnet_v2,
-                'lenet': lenet.lenet,
-                'resnet_v1_50': resnet_v1.resnet_v1_50,
-                'resnet_v1_101': resnet_v1.resnet_v1_101,
-                'resnet_v1_152': resnet_v1.resnet_v1_152,
-                'resnet_v1_200': resnet_v1.resnet_v1_200,
-                'resnet_v2_50': resnet_v2.resnet_v2_50,
-                'resnet_v2_101': resnet_v2.resnet_v2_101,
-                'resnet_v2_152': resnet_v2.resnet_v2_152,
-                'resnet_v2_200': resnet_v2.resnet_v2_200,
-                'mobilenet_v1': mobilenet_v1.mobilenet_v1,
-                'mobilenet_v1_075': mobilenet_v1.mobilenet_v1_075,
-                'mobilenet_v1_050': mobilenet_v1.mobilenet_v1_050,
-                'mobilenet_v1_025': mobilenet_v1.mobilenet_v1_025,
-                'mobilenet_v2': mobilenet_v2.mobilenet,
-                'mobilenet_v2_140': mobilenet_v2.mobilenet_v2_140,
-                'mobilenet_v2_035': mobilenet_v2.mobilenet_v2_035,
-                'nasnet_cifar': nasnet.build_nasnet_cifar,
-                'nasnet_mobile': nasnet.build_nasnet_mobile,
-                'nasnet_large': nasnet.build_nasnet_large,
-                'pnasnet_large': pnasnet.build_pnasnet_large,
-                'pnasnet_mobile': pnasnet.build_pnasnet_mobile,
-                'densenet121': densenet.densenet121,
-                'densenet161': densenet.densenet161,
-                'densenet169': densenet.densenet169,
-               }
-
-arg_scopes_map = {'alexnet_v2': alexnet.alexnet_v2_arg_scope,
-                  'cifarnet': cifarnet.cifarnet_arg_scope,
-                  'overfeat': overfeat.overfeat_arg_scope,
-                  'vgg_a': vgg.vgg_arg_scope,
-                  'vgg_16': vgg.vgg_arg_scope,
-                  'vgg_19': vgg.vgg_arg_scope,
-                  'inception_v1': inception.inception_v3_arg_scope,
-                  'inception_v2': inception.inception_v3_arg_scope,
-                  'inception_v3': inception.inception_v3_arg_scope,
-                  'inception_v4': inception.inception_v4_arg_scope,
-                  'inception_resnet_v2': inception.inception_resnet_v2_arg_scope,
-                  'lenet': lenet.lenet_arg_scope,
-                  'resnet_v1_50': resnet_v1.resnet_arg_scope,
-                  'resnet_v1_101': resnet_v1.resnet_arg_scope,
-                  'resnet_v1_152': resnet_v1.resnet_arg_scope,
-                  'resnet_v1_200': resnet_v1.resnet_arg_scope,
-                  'resnet_v2_50': resnet_v2.resnet_arg_scope,
-                  'resnet_v2_101': resnet_v2.resnet_arg_scope,
-                  'resnet_v2_152': resnet_v2.resnet_arg_scope,
-                  'resnet_v2_200': resnet_v2.resnet_arg_scope,
-                  'mobilenet_v1': mobilenet_v1.mobilenet_v1_arg_scope,
-                  'mobilenet_v1_075': mobilenet_v1.mobilenet_v1_arg_scope,
-                  'mobilenet_v1_050': mobilenet_v1.mobilenet_v1_arg_scope,
-                  'mobilenet_v1_025': mobilenet_v1.mobilenet_v1_arg_scope,
-                  'mobilenet_v2': mobilenet_v2.training_scope,
-                  'mobilenet_v2_035': mobilenet_v2.training_scope,
-                  'mobilenet_v2_140': mobilenet_v2.training_scope,
-                  'nasnet_cifar': nasnet.nasnet_cifar_arg_scope,
-                  'nasnet_mobile': nasnet.nasnet_mobile_arg_scope,
-                  'nasnet_large': nasnet.nasnet_large_arg_scope,
-                  'pnasnet_large': pnasnet.pnasnet_large_arg_scope,
-                  'pnasnet_mobile': pnasnet.pnasnet_mobile_arg_scope,
-                  'densenet121': densenet.densenet_arg_scope,
-                  'densenet161': densenet.densenet_arg_scope,
-                  'densenet169': densenet.densenet_arg_scope,
-                 }
+
+class _LazyMap(Mapping):
+  """Maps network names to objects that are only imported when looked up.
+
+  Importing every architecture up front is a large part of the startup time
+  of short jobs that only use one, so the values are kept as
+  'module:attribute' paths and resolved on access.
+  """
+
+  def __init__(self, paths):
+    self._paths = paths
+
+  def __getitem__(self, name):
+    module_name, attr = self._paths[name].split(':')
+    return getattr(importlib.import_module(module_name), attr)
+
+  def __iter__(self):
+    return iter(self._paths)
+
+  def __len__(self):
+    return len(self._paths)
+
+
+networks_map = _LazyMap({'alexnet_v2': 'nets.alexnet:alexnet_v2',
+                         'cifarnet': 'nets.cifarnet:cifarnet',
+                         'overfeat': 'nets.overfeat:overfeat',
+                         'vgg_a': 'nets.vgg:vgg_a',
+                         'vgg_16': 'nets.vgg:vgg_16',
+                         'vgg_19': 'nets.vgg:vgg_19',
+                         'inception_v1': 'nets.inception:inception_v1',
+                         'inception_v2': 'nets.inception:inception_v2',
+                         'inception_v3': 'nets.inception:inception_v3',
+                         'inception_v4': 'nets.inception:inception_v4',
+                         'inception_resnet_v2': 'nets.inception:inception_resnet_v2',
+                         'lenet': 'nets.lenet:lenet',
+                         'resnet_v1_50': 'nets.resnet_v1:resnet_v1_50',
+                         'resnet_v1_101': 'nets.resnet_v1:resnet_v1_101',
+                         'resnet_v1_152': 'nets.resnet_v1:resnet_v1_152',
+                         'resnet_v1_200': 'nets.resnet_v1:resnet_v1_200',
+                         'resnet_v2_50': 'nets.resnet_v2:resnet_v2_50',
+                         'resnet_v2_101': 'nets.resnet_v2:resnet_v2_101',
+                         'resnet_v2_152': 'nets.resnet_v2:resnet_v2_152',
+                         'resnet_v2_200': 'nets.resnet_v2:resnet_v2_200',
+                         'mobilenet_v1': 'nets.mobilenet_v1:mobilenet_v1',
+                         'mobilenet_v1_075': 'nets.mobilenet_v1:mobilenet_v1_075',
+                         'mobilenet_v1_050': 'nets.mobilenet_v1:mobilenet_v1_050',
+                         'mobilenet_v1_025': 'nets.mobilenet_v1:mobilenet_v1_025',
+                         'mobilenet_v2': 'nets.mobilenet.mobilenet_v2:mobilenet',
+                         'mobilenet_v2_140': 'nets.mobilenet.mobilenet_v2:mobilenet_v2_140',
+                         'mobilenet_v2_035': 'nets.mobilenet.mobilenet_v2:mobilenet_v2_035',
+                         'nasnet_cifar': 'nets.nasnet.nasnet:build_nasnet_cifar',
+                         'nasnet_mobile': 'nets.nasnet.nasnet:build_nasnet_mobile',
+                         'nasnet_large': 'nets.nasnet.nasnet:build_nasnet_large',
+                         'pnasnet_large': 'nets.nasnet.pnasnet:build_pnasnet_large',
+                         'pnasnet_mobile': 'nets.nasnet.pnasnet:build_pnasnet_mobile',
+                         'densenet121': 'nets.densenet:densenet121',
+                         'densenet161': 'nets.densenet:densenet161',
+                         'densenet169': 'nets.densenet:densenet169',
+                        })
+
+arg_scopes_map = _LazyMap({'alexnet_v2': 'nets.alexnet:alexnet_v2_arg_scope',
+                           'cifarnet': 'nets.cifarnet:cifarnet_arg_scope',
+                           'overfeat': 'nets.overfeat:overfeat_arg_scope',
+                           'vgg_a': 'nets.vgg:vgg_arg_scope',
+                           'vgg_16': 'nets.vgg:vgg_arg_scope',
+                           'vgg_19': 'nets.vgg:vgg_arg_scope',
+                           'inception_v1': 'nets.inception:inception_v3_arg_scope',
+                           'inception_v2': 'nets.inception:inception_v3_arg_scope',
+                           'inception_v3': 'nets.inception:inception_v3_arg_scope',
+                           'inception_v4': 'nets.inception:inception_v4_arg_scope',
+                           'inception_resnet_v2': 'nets.inception:inception_resnet_v2_arg_scope',
+                           'lenet': 'nets.lenet:lenet_arg_scope',
+                           'resnet_v1_50': 'nets.resnet_v1:resnet_arg_scope',
+                           'resnet_v1_101': 'nets.resnet_v1:resnet_arg_scope',
+                           'resnet_v1_152': 'nets.resnet_v1:resnet_arg_scope',
+                           'resnet_v1_200': 'nets.resnet_v1:resnet_arg_scope',
+                           'resnet_v2_50': 'nets.resnet_v2:resnet_arg_scope',
+                           'resnet_v2_101': 'nets.resnet_v2:resnet_arg_scope',
+                           'resnet_v2_152': 'nets.resnet_v2:resnet_arg_scope',
+                           'resnet_v2_200': 'nets.resnet_v2:resnet_arg_scope',
+                           'mobilenet_v1': 'nets.mobilenet_v1:mobilenet_v1_arg_scope',
+                           'mobilenet_v1_075': 'nets.mobilenet_v1:mobilenet_v1_arg_scope',
+                           'mobilenet_v1_050': 'nets.mobilenet_v1:mobilenet_v1_arg_scope',
+                           'mobilenet_v1_025': 'nets.mobilenet_v1:mobilenet_v1_arg_scope',
+                           'mobilenet_v2': 'nets.mobilenet.mobilenet_v2:training_scope',
+                           'mobilenet_v2_035': 'nets.mobilenet.mobilenet_v2:training_scope',
+                           'mobilenet_v2_140': 'nets.mobilenet.mobilenet_v2:training_scope',
+                           'nasnet_cifar': 'nets.nasnet.nasnet:nasnet_cifar_arg_scope',
+                           'nasnet_mobile': 'nets.nasnet.nasnet:nasnet_mobile_arg_scope',
+                           'nasnet_large': 'nets.nasnet.nasnet:nasnet_large_arg_scope',
+                           'pnasnet_large': 'nets.nasnet.pnasnet:pnasnet_large_arg_scope',
+                           'pnasnet_mobile': 'nets.nasnet.pnasnet:pnasnet_mobile_arg_scope',
+                           'densenet121': 'nets.densenet:densenet_arg_scope',
+                           'densenet161': 'nets.densenet:densenet_arg_scope',
+                           'densenet169': 'nets.densenet:densenet_arg_scope',
+                          })
 
 
 def get_network_fn(name, num_classes, weight_decay=0.0, is_training=False):
@@ -12,10 +12,11 @@ Configuration Part.
 """
 # Parameters
 tf.app.flags.DEFINE_string("test_file", './data/test.txt', "the path of test data")
+tf.app.flags.DEFINE_string("store_dir", './data/resized', "the directory of the resized images of build_resized_store.py, if built")
+tf.app.flags.DEFINE_string("stats_file", '', "the dataset statistics of compute_dataset_stats to subtract the mean of(default: the ImageNet mean)")
 tf.app.flags.DEFINE_integer("batch_size", 128, "batch_size(default:128)")
 tf.app.flags.DEFINE_integer("num_classes", 5, "num_classes(default:2)")
 FLAGS = tf.app.flags.FLAGS
-num_validation = 10000
 train_layers = ["logits"]
 
 # Load data on the cpu
@@ -26,13 +27,18 @@ with tf.device('/cpu:0'):
                                        batch_size=FLAGS.batch_size,
                                        num_classes=FLAGS.num_classes,
                                        shuffle=True,
-                                       img_out_size=densenet.densenet161.default_image_size
+                                       img_out_size=densenet.densenet161.default_image_size,
+                                       transport='uint8',
+                                       store_dir=FLAGS.store_dir,
+                                       mean=FLAGS.stats_file or None,
+                                       repeat=False
                                        )
     test_next_batch = test_iterator.iterator.get_next()
 
 
 # Initialize model
-densenet_161 = DenseNet_161(num_classes=FLAGS.num_classes, train_layers=train_layers)
+densenet_161 = DenseNet_161(num_classes=FLAGS.num_classes, train_layers=train_layers, inputs=test_next_batch,
+                            mean=test_iterator.mean)
 
 
 with tf.Session() as sess:
@@ -43,14 +49,13 @@ with tf.Session() as sess:
     model_file = tf.train.latest_checkpoint("./runs/densenet_161/1544518158/ckpt/")
     saver.restore(sess, model_file)
 
-    num_batchs_one_validation = int(num_validation / FLAGS.batch_size)
+    # one pass over the whole test set, including the last partial batch
+    sess.run(test_iterator.iterator.initializer)
     acc_list = []
-    for i in range(num_batchs_one_validation):
-        x_batch_test, y_batch_test = sess.run(test_next_batch)
-        accuracy = sess.run(densenet_161.accuracy, feed_dict={densenet_161.x_input: x_batch_test,
-                                                              densenet_161.y_input: y_batch_test,
-                                                              }
-                            )
+    size_list = []
+    for i in range(test_iterator.num_batches):
+        accuracy = sess.run(densenet_161.accuracy)
         acc_list.append(accuracy)
-    print("accuracy on test dataSet: {}".format(np.mean(acc_list)))
+        size_list.append(min(FLAGS.batch_size, test_iterator.data_size - i * FLAGS.batch_size))
+    print("accuracy on test dataSet: {}".format(np.average(acc_list, weights=size_list)))
 
@@ -1,22 +1,68 @@
 import os
-import cv2
+import time
+import json
+import mmap
+import struct
+import glob
+import hashlib
+import itertools
+import platform
+import threading
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import tensorflow as tf
-from nets import dataset_utils
 from tensorflow.python.framework import dtypes
 from tensorflow.python import pywrap_tensorflow
+from tensorflow.python.ops import io_ops
+from tensorflow.core.protobuf import tensor_bundle_pb2
 from tensorflow.python.framework.ops import convert_to_tensor
 try:
     import urllib2 as urllib
 except ImportError:
     import urllib.request as urllib
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+# per-channel RGB mean, turned into a constant of the graph that normalizes,
+# so importing this module creates no ops. cv2 and nets.dataset_utils are
+# imported by the few functions that need them, to keep the import cheap
+IMAGENET_MEAN = [121.55213, 113.84197, 99.5037]
+
+# describes the preprocessing baked into the image cache, change it whenever
+# `_decode_and_resize` changes so stale caches are rebuilt
+IMAGE_CACHE_VERSION = "decode_sniffed-jpeg_ratio-resize_bilinear-uint8-v2"
+
+# magic of the flat weight files of `convert_checkpoint_weights`, and the
+# alignment of their header and tensors in bytes
+FLAT_WEIGHTS_MAGIC = b"TFSLIMW1"
+FLAT_WEIGHTS_ALIGNMENT = 64
 
+# parallelism of the input pipeline, used for every key that is not given in
+# the `pipeline_config` of an ImageDataGenerator
+DEFAULT_PIPELINE_CONFIG = {'num_parallel_calls': 20, 'prefetch': 1, 'cycle_length': 8}
 
-IMAGENET_MEAN = tf.constant([121.55213, 113.84197, 99.5037], dtype=tf.float32)
+# strength of the training augmentation, used for every key that is not given
+# in the `augment_config` of an ImageDataGenerator
+DEFAULT_AUGMENT_CONFIG = {'min_scale': 0.35, 'flip': True, 'brightness': 32.0, 'contrast': 0.2, 'saturation': 0.2}
+
+# one record per manifest entry in the index written by `build_image_index`,
+# format is 0 for an unusable entry and 1 + its position in IMAGE_INDEX_FORMATS otherwise
+IMAGE_INDEX_FORMATS = [b'jpeg', b'png', b'bmp']
+IMAGE_INDEX_DTYPE = np.dtype([('format', np.uint8), ('height', np.uint32), ('width', np.uint32), ('num_bytes', np.uint64)])
 
 
 class ImageDataGenerator(object):
-    def __init__(self, txt_file, mode, batch_size, num_classes, shuffle=True, buffer_size=1000, img_out_size=224):
+    def __init__(self, txt_file, mode, batch_size, num_classes, shuffle=True, buffer_size=1000, img_out_size=224,
+                 source='text', cache_dir=None, ram_cache_bytes=0, ram_cache_compress=False, pipeline_config=None,
+                 autotune_batches=10, full_shuffle=False, transport='float32', stream_manifest=False,
+                 repeat=True, num_workers=1, worker_index=0, seed=None, start_position=0, augment=False,
+                 augment_config=None, decode_backend='tf', decode_workers=None, monitor=False, image_index=None,
+                 store_dir=None, mean=None):
         """Create a new ImageDataGenerator.
         Recieves a path string to a text file, which consists of many lines,
         where each line has first a path string to an image and seperated by
@@ -31,54 +77,621 @@ class ImageDataGenerator(object):
             num_classes: Number of classes in the dataset.
             shuffle: Wether or not to shuffle the data
                 in the dataset and the initial file list.
-            buffer_size: Number of images used as buffer for TensorFlows
-                shuffling of the dataset.
+            buffer_size: Number of samples used as buffer for TensorFlows
+                shuffling of the dataset. The samples are shuffled before they
+                are read, so the buffer only holds paths (or cache indices,
+                or encoded TFRecord images) and no decoded images.
+            img_out_size: Height and width of the images in the batches.
+            source: Either 'text' or 'tfrecord'. With 'text', `txt_file` is
+                the image manifest described above. With 'tfrecord',
+                `txt_file` is the shard index written by
+                `convert_to_tfrecord` and the images are streamed from the
+                shards instead of being opened one by one.
+            cache_dir: If given, the decoded and resized images of a 'text'
+                source are stored once in a memory-mapped uint8 file in this
+                directory (see `build_image_cache`), and read back from it
+                without decoding.
+            ram_cache_bytes: If > 0, the decoded and resized images of a
+                'text' source are kept in memory up to this many bytes, see
+                `SampleCache`. The cache is available as `self.ram_cache`.
+            ram_cache_compress: Whether the in-memory cache stores the resized
+                images PNG encoded, so more of them fit into the budget.
+            pipeline_config: Dict with the map parallelism
+                ('num_parallel_calls'), the number of prefetched batches
+                ('prefetch') and the number of TFRecord shards read at once
+                ('cycle_length'). Missing keys fall back to
+                DEFAULT_PIPELINE_CONFIG. Pass 'autotune' to measure the
+                throughput of the pipeline on this host and pick the fastest
+                map parallelism (and cycle_length). The prefetch depth is
+                not tuned, it only matters against a consumer that overlaps
+                with the pipeline. The config in use is available as
+                `self.pipeline_config`, so a tuned one can be pinned.
+            autotune_batches: Number of batches timed per candidate config
+                when autotuning.
+            full_shuffle: Whether to reshuffle over the whole dataset every
+                epoch instead of over `buffer_size` samples. For the 'text'
+                source only a permutation of the sample indices is drawn, so
+                this costs a few bytes per sample. The 'tfrecord' source keeps
+                using `buffer_size`, as its buffer holds encoded images.
+            transport: Either 'float32' or 'uint8'. With 'float32' the batches
+                hold mean-subtracted float images. With 'uint8' they hold the
+                resized images as uint8, a quarter of the bytes, and the
+                model has to subtract the mean itself (e.g. the model classes
+                with uint8_input=True, see `_normalize_images`).
+            stream_manifest: Whether to stream the manifest of a 'text' source
+                instead of loading it into lists and embedding every path in
+                the graph, for manifests too large for either. Shuffling then
+                always draws a full permutation of the samples every epoch.
+            repeat: Whether to repeat the data forever. Without repeating the
+                iterator makes a single pass over the data, including the last
+                partial batch, in `self.num_batches` batches. It has to be
+                initialized with `sess.run(self.iterator.initializer)`, which
+                also restarts it for the next pass.
+            num_workers: Number of processes reading the same data, each with
+                its own ImageDataGenerator. Every worker only reads and
+                decodes its own disjoint share of the samples ('text'
+                source) or of the shards ('tfrecord' source), and
+                `self.data_size` is the size of that share.
+            worker_index: Index of this worker, in [0, num_workers).
+            seed: Seed of the per-epoch permutations of the samples. All
+                workers must pass the same seed, so that their shares stay
+                disjoint when the samples are reshuffled every epoch.
+            start_position: Number of samples of this worker's sample stream
+                to skip, to resume an interrupted run at the exact sample it
+                stopped at (see `save_input_state`). Only sample indices are
+                skipped, no image is read. Needs a repeating 'text' source
+                and the same seed as the interrupted run.
+            augment: Whether to augment the images of the 'training' mode with
+                a random crop and scale, a horizontal flip and color jitter.
+                The augmentation runs on whole batches after `data.batch`, so
+                every op is dispatched once per batch instead of per image.
+            augment_config: Dict with the smallest crop area as a fraction of
+                the image ('min_scale'), whether to flip ('flip'), the largest
+                brightness change in pixel values ('brightness') and the
+                largest relative contrast and saturation changes ('contrast',
+                'saturation'). Missing keys fall back to DEFAULT_AUGMENT_CONFIG.
+            decode_backend: Either 'tf' or 'opencv'. With 'opencv' a pool of
+                `decode_workers` processes decodes and resizes the images of
+                a 'text' source with cv2 into shared memory, see
+                `_make_opencv_dataset`. Shuffling then always draws a full
+                permutation of the samples every epoch, which is a different
+                order than the one of the 'tf' backend for the same seed.
+                Call `close()` to stop the processes.
+            decode_workers: Number of decode processes of the 'opencv'
+                backend, defaults to the number of CPUs.
+            monitor: Whether to record the time every batch is ready in
+                `self.batch_ready_times`, for an `InputMonitor` that consumes
+                them. Only for an iterator that is read by monitored steps.
+            image_index: Path of the index of the manifest written by
+                `build_image_index`. Entries that can not be read or decoded
+                are dropped up front, and the images that already have the
+                size img_out_size x img_out_size are only decoded, not
+                resized. Needs a 'text' source without cache_dir
+                or stream_manifest. Defaults to the index that
+                build_image_index.py wrote for the current contents of
+                txt_file, if there is one.
+            store_dir: Directory of the stores of pre-resized images written
+                by `build_resized_store`. If it holds a store of txt_file at
+                img_out_size, the manifest of the store is used instead of
+                txt_file, together with the image index of the store when
+                possible. Otherwise the original images are read.
+            mean: Per-channel RGB mean subtracted from the images, or the path
+                of the statistics written by `compute_dataset_stats`. Defaults
+                to IMAGENET_MEAN. The mean in use is available as `self.mean`,
+                to be passed on to a model that gets uint8 batches.
         Raises:
-            ValueError: If an invalid mode is passed.
+            ValueError: If an invalid mode, source, transport or decode_backend
+                is passed, if cache_dir is used with a source other than 'text'
+                or with stream_manifest, if the worker settings are
+                inconsistent, if start_position is used with the 'tfrecord'
+                source, or if the 'opencv' backend is combined with anything
+                but a plain 'text' source.
         """
 
+        # read the pre-resized images of a matching store if there is one
+        store_manifest = None
+        if store_dir is not None and source == 'text':
+            store_manifest = resized_store_manifest(txt_file, store_dir, img_out_size)
+        if store_manifest is not None:
+            print("reading the resized images of {}".format(store_manifest))
+            txt_file = store_manifest
+            # an index of the original manifest does not match the lines of the store
+            image_index = None
+
+        # use the index `build_image_index` (or the store) wrote for the manifest, if there is one
+        if image_index is None and source == 'text' and cache_dir is None and not stream_manifest:
+            if os.path.exists(_image_index_path(txt_file)):
+                image_index = _image_index_path(txt_file)
+
         self.txt_file = txt_file
         self.num_classes = num_classes
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.full_shuffle = full_shuffle
+        self.stream_manifest = stream_manifest
+        self.repeat = repeat
+        self.augment = augment and mode == 'training'
+        self.augment_config = dict(DEFAULT_AUGMENT_CONFIG, **(augment_config or {}))
+        self.mean = load_dataset_stats(mean)['mean'] if isinstance(mean, str) else mean
+
+        if not 0 <= worker_index < num_workers:
+            raise ValueError("Invalid worker_index {} for {} workers" .format(worker_index, num_workers))
+        if num_workers > 1 and seed is None:
+            raise ValueError("All {} workers need to pass the same seed" .format(num_workers))
+        self.num_workers = num_workers
+        self.worker_index = worker_index
+        self.seed = seed if seed is not None else np.random.randint(2 ** 31 - 1)
+
+        if start_position > 0 and (source == 'tfrecord' or not repeat):
+            raise ValueError("start_position needs a repeating 'text' source")
+        self.start_position = start_position
+
+        # the resize img
+        self.img_out_size = img_out_size
+
+        if transport not in ('float32', 'uint8'):
+            raise ValueError("Invalid transport {}" .format(transport))
+        self.transport = transport
+
+        # in-memory cache of decoded images, only used by the 'text' source
+        self.ram_cache = SampleCache(ram_cache_bytes, compress=ram_cache_compress) if ram_cache_bytes > 0 else None
+
+        if cache_dir is not None and source != 'text':
+            raise ValueError("cache_dir is only supported with source 'text', got {}" .format(source))
+        if cache_dir is not None and stream_manifest:
+            raise ValueError("cache_dir is not supported with stream_manifest")
+        if image_index is not None and (source != 'text' or cache_dir is not None or stream_manifest):
+            raise ValueError("image_index needs a 'text' source without cache_dir or stream_manifest")
+        self.image_index = image_index
+        self.image_sizes = None
+
+        if decode_backend not in ('tf', 'opencv'):
+            raise ValueError("Invalid decode_backend {}" .format(decode_backend))
+        if decode_backend == 'opencv' and (source != 'text' or cache_dir is not None or stream_manifest
+                                           or self.ram_cache is not None or pipeline_config == 'autotune'):
+            raise ValueError("The 'opencv' backend only reads a 'text' source without caches, streaming or autotuning")
+        self._decode_processes = []
+        self._manifest = None
+
+        if pipeline_config == 'autotune':
+            self.pipeline_config = self._autotune_pipeline(source, cache_dir, batch_size, autotune_batches)
+        else:
+            self.pipeline_config = dict(DEFAULT_PIPELINE_CONFIG, **(pipeline_config or {}))
+        num_parallel_calls = self.pipeline_config['num_parallel_calls']
+
+        if decode_backend == 'opencv':
+            data = self._make_opencv_dataset(shuffle, batch_size, decode_workers)
+        else:
+            data = self._make_source_dataset(source, shuffle, cache_dir)
+
+        # distinguish between train/infer. when calling the parsing functions
+        if mode == 'training':
+            data = data.map(self._parse_function_train, num_parallel_calls=num_parallel_calls)
+
+        elif mode == 'inference':
+            data = data.map(self._parse_function_inference, num_parallel_calls=num_parallel_calls)
+
+        else:
+            raise ValueError("Invalid mode {}" .format(mode))
+
+        # create a new dataset with batches of images, the 'opencv' backend
+        # already delivers batches (the parsing functions are elementwise)
+        if decode_backend == 'tf':
+            data = data.batch(batch_size)
+        if self.augment:
+            data = data.map(self._augment_batch)
+
+        # ready times of the batches that were not consumed yet, see `InputMonitor`
+        self.batch_ready_times = collections.deque()
+        if monitor:
+            data = data.map(self._stamp_batch)
+        if repeat:
+            data = data.repeat()
+
+        # prepare the next batches while the current one is consumed
+        if self.pipeline_config['prefetch'] > 0:
+            data = data.prefetch(self.pipeline_config['prefetch'])
+
+        if repeat:
+            iterator = data.make_one_shot_iterator()
+        else:
+            iterator = data.make_initializable_iterator()
+        self.iterator = iterator
+
+        # number of batches in one pass over the data
+        self.num_batches = int(np.ceil(self.data_size / float(batch_size)))
+
+    def _make_source_dataset(self, source, shuffle, cache_dir):
+        """Create a dataset of (image, label) from the given source."""
+        if source == 'text' and cache_dir is not None:
+            return self._make_cached_dataset(shuffle, cache_dir)
+
+        elif source == 'text' and self.stream_manifest:
+            return self._make_streamed_dataset(shuffle)
+
+        elif source == 'text':
+            return self._make_text_dataset(shuffle)
+
+        elif source == 'tfrecord':
+            return self._make_tfrecord_dataset(shuffle)
+
+        else:
+            raise ValueError("Invalid source {}" .format(source))
+
+    def _measure_throughput(self, source, cache_dir, batch_size, num_batches):
+        """Time the read and decode stages of the pipeline, in images/sec.
+
+        The pipeline is built in a graph of its own with the current
+        `self.pipeline_config`, reading the data in file order.
+        """
+        with tf.Graph().as_default():
+            data = self._make_source_dataset(source, False, cache_dir)
+            data = data.map(lambda image, label: (self._decode_function(image), label),
+                            num_parallel_calls=self.pipeline_config['num_parallel_calls'])
+            data = data.batch(batch_size).repeat()
+            if self.pipeline_config['prefetch'] > 0:
+                data = data.prefetch(self.pipeline_config['prefetch'])
+            next_batch = data.make_one_shot_iterator().get_next()
+
+            with tf.Session() as sess:
+                # the first batch pays for starting the threads
+                sess.run(next_batch)
+                start = time.time()
+                for _ in range(num_batches):
+                    sess.run(next_batch)
+                return num_batches * batch_size / (time.time() - start)
+
+    def _autotune_pipeline(self, source, cache_dir, batch_size, num_batches):
+        """Pick the pipeline config with the highest measured throughput.
+
+        Every knob is tuned in turn over a few candidate values, keeping the
+        best value of the knobs tuned before (coordinate ascent). The timing
+        runs have no consumer that overlaps with the pipeline, so the prefetch
+        depth keeps its default, its measured effect would be noise.
+        """
+        num_cpus = multiprocessing.cpu_count()
+        candidates = [('num_parallel_calls', sorted({max(1, num_cpus // 2), num_cpus, 2 * num_cpus}))]
+        if source == 'tfrecord':
+            candidates.append(('cycle_length', [1, 2, 4, 8, 16]))
+
+        # do not warm up the in-memory cache with the timing runs
+        ram_cache = self.ram_cache
+        self.ram_cache = None
 
+        config = dict(DEFAULT_PIPELINE_CONFIG, num_parallel_calls=num_cpus)
+        print("autotuning input pipeline ...")
+        try:
+            for key, values in candidates:
+                throughputs = []
+                for value in values:
+                    self.pipeline_config = dict(config, **{key: value})
+                    throughputs.append(self._measure_throughput(source, cache_dir, batch_size, num_batches))
+                    print("{}: {}, images/sec: {:.1f}".format(key, value, throughputs[-1]))
+                config[key] = values[int(np.argmax(throughputs))]
+        finally:
+            self.ram_cache = ram_cache
+
+        print("tuned pipeline config: {}".format(config))
+        return config
+
+    def _make_text_dataset(self, shuffle):
+        """Create a dataset of (image bytes, label) from the image manifest."""
         # retrieve the data from the text file
         self._read_txt_file()
+        self._apply_image_index()
 
-        # number of samples in the dataset
-        self.data_size = len(self.labels)
+        # number of samples in the dataset and in the share of this worker
+        num_samples = len(self.labels)
+        self.data_size = self._share_size(num_samples)
 
         # initial shuffling of the file and label lists (together!)
-        if shuffle:
+        if shuffle and not self._use_index_order():
             self._shuffle_lists()
 
-        # the resize img
-        self.img_out_size = img_out_size
-
         # convert lists to TF tensor
         self.img_paths = convert_to_tensor(self.img_paths, dtype=dtypes.string)
         self.labels = convert_to_tensor(self.labels, dtype=dtypes.int32)
 
-        # create dataset
-        data = tf.data.Dataset.from_tensor_slices((self.img_paths, self.labels))
+        # the records of an image index carry the [height, width] of their image
+        # on to `_decode_function`, as (path, size) in place of the path
+        if self.image_sizes is not None:
+            self.image_sizes = convert_to_tensor(self.image_sizes, dtype=dtypes.int32)
 
-        # distinguish between train/infer. when calling the parsing functions
-        if mode == 'training':
-            data = data.map(self._parse_function_train, num_parallel_calls=20)
+        # create dataset, shuffled before any image is read
+        if self._use_index_order():
+            data = self._index_dataset(num_samples, shuffle)
+            if self.image_sizes is None:
+                data = data.map(lambda i: (tf.gather(self.img_paths, i), tf.gather(self.labels, i)))
+            else:
+                data = data.map(lambda i: ((tf.gather(self.img_paths, i), tf.gather(self.image_sizes, i)),
+                                           tf.gather(self.labels, i)))
+        elif self.image_sizes is None:
+            data = tf.data.Dataset.from_tensor_slices((self.img_paths, self.labels))
+        else:
+            data = tf.data.Dataset.from_tensor_slices(((self.img_paths, self.image_sizes), self.labels))
+        if not self._use_index_order() and shuffle:
+            data = data.shuffle(buffer_size=self.buffer_size, reshuffle_each_iteration=True)
 
-        elif mode == 'inference':
-            data = data.map(self._parse_function_inference, num_parallel_calls=20)
+        return self._read_records(data)
+
+    def _make_streamed_dataset(self, shuffle):
+        """Create a dataset of (image bytes, label) streamed from the image manifest.
+
+        Neither the paths nor the labels are kept in lists or embedded in the
+        graph. Without shuffling the manifest is read line by line. With
+        shuffling (or sharding) the line numbers come from `_index_dataset`,
+        and each line is read at its byte offset from a read-only mapping of
+        the manifest, which the parallel map calls slice without a lock.
+        """
+        # byte offset of every line, 8 bytes per sample
+        self.line_offsets = _index_lines(self.txt_file)
+
+        # number of samples in the dataset and in the share of this worker
+        num_samples = len(self.line_offsets) - 1
+        self.data_size = self._share_size(num_samples)
+
+        if shuffle or self._use_index_order():
+            # autotuning builds the dataset once per candidate config, keep one mapping
+            if self._manifest is not None:
+                self._manifest.close()
+            with open(self.txt_file, 'rb') as f:
+                self._manifest = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 
+            data = self._index_dataset(num_samples, shuffle)
+            data = data.map(self._read_line_function, num_parallel_calls=self.pipeline_config['num_parallel_calls'])
         else:
-            raise ValueError("Invalid mode {}" .format(mode))
+            data = tf.data.TextLineDataset(self.txt_file)
+            data = data.map(self._parse_line_function, num_parallel_calls=self.pipeline_config['num_parallel_calls'])
+
+        return self._read_records(data)
+
+    def _make_opencv_dataset(self, shuffle, batch_size, decode_workers):
+        """Create a dataset of (image batch, label batch) decoded by OpenCV processes.
+
+        A pool of processes decodes and resizes whole batches with cv2,
+        outside of the GIL and of TF's per-op overhead, directly into a ring
+        of preallocated batch buffers in shared memory. Nothing is pickled
+        between the processes but the sample indices, and the only copy of a
+        batch is the one out of its slot into the batch tensor, after which
+        the slot is reused.
+        """
+        # retrieve the data from the text file
+        self._read_txt_file()
+        self._apply_image_index()
+
+        # number of samples in the dataset and in the share of this worker
+        num_samples = len(self.labels)
+        self.data_size = self._share_size(num_samples)
+        self._label_array = np.asarray(self.labels, dtype=np.int32)
+
+        # one batch in flight per process, one being consumed and one spare
+        decode_workers = decode_workers or multiprocessing.cpu_count()
+        ring_shape = (decode_workers + 2, batch_size, self.img_out_size, self.img_out_size, 3)
+        buffer = multiprocessing.RawArray('B', int(np.prod(ring_shape)))
+        self._ring = np.frombuffer(buffer, dtype=np.uint8).reshape(ring_shape)
+        self._ring_tasks = multiprocessing.Queue()
+        self._ring_done = multiprocessing.Queue()
+        self._ring_pending = set()
+
+        # the forked processes inherit the paths and the shared buffer
+        for _ in range(decode_workers):
+            process = multiprocessing.Process(target=_opencv_decode_worker,
+                                              args=(self._ring_tasks, self._ring_done, buffer, ring_shape,
+                                                    self.img_paths, self.img_out_size))
+            process.daemon = True
+            process.start()
+            self._decode_processes.append(process)
+
+        output_shapes = (tf.TensorShape([None, self.img_out_size, self.img_out_size, 3]), tf.TensorShape([None]))
+        return tf.data.Dataset.from_generator(lambda: self._opencv_batches(num_samples, shuffle, batch_size),
+                                              output_types=(tf.uint8, tf.int32),
+                                              output_shapes=output_shapes)
+
+    def _opencv_batches(self, num_samples, shuffle, batch_size):
+        """Yield the batches of one pass of the 'opencv' backend, in order."""
+        # wait for the batches of an earlier pass that were never consumed,
+        # their processes may still be writing into the slots
+        while self._ring_pending:
+            self._ring_pending.discard(self._next_done_slot()[0])
+
+        batches = self._index_batches(num_samples, shuffle, batch_size)
+        free_slots = list(range(len(self._ring)))
+        submitted = collections.deque()
+        finished = {}
+
+        def _submit():
+            while free_slots:
+                indices = next(batches, None)
+                if indices is None:
+                    return
+                slot = free_slots.pop()
+                self._ring_tasks.put((slot, indices))
+                self._ring_pending.add(slot)
+                submitted.append((slot, indices))
+
+        _submit()
+        while submitted:
+            slot, indices = submitted.popleft()
+            while slot not in finished:
+                done_slot, error = self._next_done_slot()
+                self._ring_pending.discard(done_slot)
+                finished[done_slot] = error
+            error = finished.pop(slot)
+            if error is not None:
+                raise IOError(error)
+
+            # copied out of the slot, as TF may keep referring to the array it is handed
+            yield self._ring[slot, :len(indices)].copy(), self._label_array[indices]
+            free_slots.append(slot)
+            _submit()
+
+    def _next_done_slot(self, timeout=1.0):
+        """Wait for the next (slot, error) of the decode processes.
+
+        A process that was killed (e.g. for lack of memory) never reports its
+        slot, so the processes are checked every `timeout` seconds and an
+        error is raised instead of waiting forever.
+        """
+        while True:
+            try:
+                return self._ring_done.get(timeout=timeout)
+            except queue.Empty:
+                dead = [process for process in self._decode_processes if not process.is_alive()]
+                if dead:
+                    raise RuntimeError("{} OpenCV decode processes died, exit codes {}"
+                                       .format(len(dead), [process.exitcode for process in dead]))
+
+    def _index_batches(self, num_samples, shuffle, batch_size):
+        """Yield batches of the sample indices read by this worker.
+
+        The numpy counterpart of `_index_dataset`: every epoch is a
+        permutation that only depends on `self.seed` and the epoch number,
+        sharded among the workers, starting `self.start_position` samples in.
+        """
+        first_epoch, offset = divmod(self.start_position, max(self._share_size(num_samples), 1))
+        epochs = itertools.count(first_epoch) if self.repeat else range(1)
 
-        # shuffle the first `buffer_size` elements of the dataset
+        def _epoch_indices(epoch):
+            if shuffle:
+                indices = np.random.RandomState((self.seed + epoch) % 2 ** 32).permutation(num_samples)
+            else:
+                indices = np.arange(num_samples)
+            return indices[self.worker_index::self.num_workers]
+
+        stream = itertools.islice(itertools.chain.from_iterable(_epoch_indices(epoch) for epoch in epochs), offset, None)
+        while True:
+            indices = np.fromiter(itertools.islice(stream, batch_size), dtype=np.int64)
+            if not len(indices):
+                return
+            yield indices
+
+    def close(self):
+        """Stop the decode processes of the 'opencv' backend and unmap a streamed manifest."""
+        for _ in self._decode_processes:
+            self._ring_tasks.put(None)
+        for process in self._decode_processes:
+            process.join()
+        self._decode_processes = []
+        if self._manifest is not None:
+            self._manifest.close()
+            self._manifest = None
+
+    def _use_index_order(self):
+        """Whether samples are ordered by `_index_dataset` rather than a shuffle buffer."""
+        return self.full_shuffle or self.num_workers > 1 or self.start_position > 0
+
+    def _share_size(self, num_samples):
+        """Number of samples in the share of this worker."""
+        return len(range(self.worker_index, num_samples, self.num_workers))
+
+    def _index_dataset(self, num_samples, shuffle):
+        """Create a dataset of the indices of the samples read by this worker.
+
+        When shuffling, the indices of every epoch are a permutation that only
+        depends on `self.seed` and the epoch number (a stateless random op),
+        so all workers draw the same permutation. Each worker keeps every
+        num_workers-th index of it, so the shares are disjoint in every epoch.
+        The permutation is drawn in the graph, 8 bytes per sample.
+
+        The sample stream of this worker starts `self.start_position` samples
+        in, at the matching epoch and offset.
+        """
+        def _epoch_indices(epoch):
+            if not shuffle:
+                return tf.data.Dataset.range(num_samples).shard(self.num_workers, self.worker_index)
+
+            seed = tf.stack([tf.constant(self.seed, dtype=tf.int64), epoch])
+            scores = tf.contrib.stateless.stateless_random_uniform([num_samples], seed=seed)
+            permutation = tf.cast(tf.nn.top_k(scores, k=num_samples).indices, tf.int64)
+            return tf.data.Dataset.from_tensor_slices(permutation).shard(self.num_workers, self.worker_index)
+
+        first_epoch, offset = divmod(self.start_position, max(self._share_size(num_samples), 1))
+
+        # the epochs are counted here, the outer repeat() never restarts this dataset
+        num_epochs = np.iinfo(np.int64).max if self.repeat else 1
+        data = tf.data.Dataset.range(first_epoch, num_epochs).flat_map(_epoch_indices)
+        return data.skip(offset)
+
+    def _read_records(self, data):
+        """Read the images of a dataset of (path, label) records."""
+        if self.ram_cache is not None:
+            return data.map(self._read_ram_cached_function,
+                            num_parallel_calls=self.pipeline_config['num_parallel_calls'])
+        return data.map(self._read_function, num_parallel_calls=self.pipeline_config['num_parallel_calls'])
+
+    def _make_tfrecord_dataset(self, shuffle):
+        """Create a dataset of (image bytes, label) from TFRecord shards.
+
+        The shards are read with a parallel interleave, so every reader
+        streams one large file sequentially instead of doing a random read
+        per image.
+        """
+        self._read_shard_index()
+        if len(self.shard_paths) < self.num_workers:
+            raise ValueError("{} shards can not be split among {} workers"
+                             .format(len(self.shard_paths), self.num_workers))
+
+        # every worker reads whole shards of its own
+        shard_paths = self.shard_paths[self.worker_index::self.num_workers]
+
+        # number of samples in the share of this worker
+        self.data_size = sum(self.shard_sizes[self.worker_index::self.num_workers])
+
+        shards = tf.data.Dataset.from_tensor_slices(convert_to_tensor(shard_paths, dtype=dtypes.string))
         if shuffle:
-            data = data.shuffle(buffer_size=buffer_size)
+            shards = shards.shuffle(buffer_size=len(shard_paths))
 
-        # create a new dataset with batches of images
-        data = data.batch(batch_size)
-        data = data.repeat()
-        iterator = data.make_one_shot_iterator()
-        self.iterator = iterator
+        # a deterministic order is only needed when the data is not shuffled
+        data = shards.apply(tf.contrib.data.parallel_interleave(tf.data.TFRecordDataset,
+                                                                cycle_length=min(len(shard_paths),
+                                                                                 self.pipeline_config['cycle_length']),
+                                                                sloppy=shuffle))
+
+        # shuffle the still encoded images
+        if shuffle:
+            data = data.shuffle(buffer_size=self.buffer_size, reshuffle_each_iteration=True)
+        return data.map(self._parse_example, num_parallel_calls=self.pipeline_config['num_parallel_calls'])
+
+    def _make_cached_dataset(self, shuffle, cache_dir):
+        """Create a dataset of (decoded image, label) from the image cache.
+
+        The cache is built on first use. The images are then sliced out of
+        the memory-mapped file, so no image is read or decoded again.
+        """
+        cache_path, _ = build_image_cache(self.txt_file, cache_dir, img_out_size=self.img_out_size)
+
+        # the cache holds the images in manifest order
+        self._read_txt_file()
+
+        # number of samples in the dataset and in the share of this worker
+        num_samples = len(self.labels)
+        self.data_size = self._share_size(num_samples)
+
+        self.cached_images = np.memmap(cache_path, dtype=np.uint8, mode='r',
+                                       shape=(num_samples, self.img_out_size, self.img_out_size, 3))
+
+        # shuffle the indices into the cache instead of the file list
+        if self._use_index_order():
+            labels = convert_to_tensor(np.asarray(self.labels, dtype=np.int32))
+            data = self._index_dataset(num_samples, shuffle)
+            data = data.map(lambda i: (i, tf.gather(labels, i)))
+        else:
+            indices = np.random.permutation(num_samples) if shuffle else np.arange(num_samples)
+            labels = np.asarray(self.labels, dtype=np.int32)[indices]
+            data = tf.data.Dataset.from_tensor_slices((indices, labels))
+            if shuffle:
+                data = data.shuffle(buffer_size=self.buffer_size, reshuffle_each_iteration=True)
+        return data.map(self._read_cached_function, num_parallel_calls=self.pipeline_config['num_parallel_calls'])
+
+    def _read_shard_index(self):
+        """Read the shard paths and their number of records from the index."""
+        self.shard_paths = []
+        self.shard_sizes = []
+        with open(self.txt_file, 'r') as f:
+            for line in f:
+                items = line.split(' ')
+                self.shard_paths.append(items[0])
+                self.shard_sizes.append(int(items[1]))
 
     def _read_txt_file(self):
         """Read the content of the text file and store it into lists."""
@@ -91,6 +704,37 @@ class ImageDataGenerator(object):
                 self.img_paths.append(items[0])
                 self.labels.append(int(items[1]))
 
+    def _apply_image_index(self):
+        """Drop the manifest entries the image index marks as unusable.
+
+        An index that was built from other contents of the manifest than the
+        current ones is rejected, its entries would not match the lines.
+
+        The [height, width] of the remaining images are kept in
+        `self.image_sizes`, unless none of them has the output size already.
+        """
+        self.image_sizes = None
+        if self.image_index is None:
+            return
+        # the index is named after the hash of the manifest it was built from
+        if os.path.abspath(self.image_index) != os.path.abspath(_image_index_path(self.txt_file)):
+            raise ValueError("The image index {} was not built from the current contents of {}, "
+                             "rebuild it with build_image_index".format(self.image_index, self.txt_file))
+        index = np.load(self.image_index)
+        if len(index) != len(self.labels):
+            raise ValueError("The image index {} has {} entries, but the manifest {} has {}, rebuild it"
+                             .format(self.image_index, len(index), self.txt_file, len(self.labels)))
+
+        valid = index['format'] > 0
+        if not valid.all():
+            print("dropping {} unusable images of {}".format(int((~valid).sum()), self.txt_file))
+            self.img_paths = [path for path, keep in zip(self.img_paths, valid) if keep]
+            self.labels = [label for label, keep in zip(self.labels, valid) if keep]
+
+        index = index[valid]
+        if np.any((index['height'] == self.img_out_size) & (index['width'] == self.img_out_size)):
+            self.image_sizes = np.stack([index['height'], index['width']], axis=1).astype(np.int32).tolist()
+
     def _shuffle_lists(self):
         """Conjoined shuffling of the list of paths and labels."""
         path = self.img_paths
@@ -101,36 +745,174 @@ class ImageDataGenerator(object):
         for i in permutation:
             self.img_paths.append(path[i])
             self.labels.append(labels[i])
+        if self.image_sizes is not None:
+            self.image_sizes = [self.image_sizes[i] for i in permutation]
 
-    def _parse_function_train(self, filename, label):
-        """Input parser for samples of the training set."""
-        # convert label number into one-hot-encoding
-        one_hot = tf.one_hot(label, self.num_classes)
+    def _read_line(self, index):
+        """Read the manifest line with the given number from its byte offset."""
+        start, end = self.line_offsets[index], self.line_offsets[index + 1]
+        return self._manifest[start:end].rstrip(b'\r\n')
+
+    def _read_line_function(self, index):
+        """Read and parse the manifest line with the given number."""
+        line = tf.py_func(self._read_line, [index], tf.string, stateful=False)
+        return self._parse_line_function(line)
 
-        # load and preprocess the image
+    def _parse_line_function(self, line):
+        """Split a manifest line into the image path and the label."""
+        filename, label = tf.decode_csv(line, record_defaults=[[''], [0]], field_delim=' ')
+        return filename, label
+
+    def _read_function(self, filename, label):
+        """Read the encoded image of a manifest entry."""
+        # an entry of an image index passes the size of its image on
+        if isinstance(filename, tuple):
+            filename, size = filename
+            return (tf.read_file(filename), size), label
         img_string = tf.read_file(filename)
-        img_decoded = tf.image.decode_png(img_string, channels=3)
-        img_resized = tf.image.resize_images(img_decoded, [self.img_out_size, self.img_out_size])
+        return img_string, label
+
+    def _read_ram_cached_function(self, filename, label):
+        """Take the decoded image of a manifest entry from the in-memory cache.
+
+        On a miss the image is read, decoded and resized as usual and then
+        inserted into the cache.
         """
-        Dataaugmentation comes here.
+        # the cached images are resized already, the size of the image index is not needed
+        if isinstance(filename, tuple):
+            filename = filename[0]
+        hit, cached = tf.py_func(self.ram_cache.lookup, [filename], [tf.bool, tf.uint8])
+        hit.set_shape([])
+
+        def _decode_and_insert():
+            image = _decode_to_uint8(tf.read_file(filename), self.img_out_size)
+            return tf.py_func(self.ram_cache.insert, [filename, image], tf.uint8)
+
+        image = tf.cond(hit, lambda: cached, _decode_and_insert)
+        image.set_shape([self.img_out_size, self.img_out_size, 3])
+        return image, label
+
+    def _read_cached_function(self, index, label):
+        """Slice the decoded image of a manifest entry out of the image cache."""
+        image = tf.py_func(lambda i: np.asarray(self.cached_images[i]), [index], tf.uint8, stateful=False)
+        image.set_shape([self.img_out_size, self.img_out_size, 3])
+        return image, label
+
+    def _decode_function(self, image):
+        """Decode and resize an encoded image into the transport dtype.
+
+        Images read from the image caches are already decoded and resized and
+        at most need to be converted to float. Images that come with their
+        [height, width] from the image index (see `_read_function`) are only
+        decoded when they already have the output size.
         """
-        img_centered = tf.subtract(img_resized, IMAGENET_MEAN)
+        if isinstance(image, tuple):
+            img_string, size = image
+            if self.transport == 'uint8':
+                decode = lambda: _decode_image(img_string, self.img_out_size)
+                resize = lambda: _decode_to_uint8(img_string, self.img_out_size)
+            else:
+                decode = lambda: tf.cast(_decode_image(img_string, self.img_out_size), tf.float32)
+                resize = lambda: _decode_and_resize(img_string, self.img_out_size)
+            image = tf.cond(tf.reduce_all(tf.equal(size, self.img_out_size)), decode, resize)
+            image.set_shape([self.img_out_size, self.img_out_size, 3])
+            return image
+
+        if self.transport == 'uint8':
+            if image.dtype == tf.uint8:
+                return image
+            return _decode_to_uint8(image, self.img_out_size)
+
+        if image.dtype == tf.uint8:
+            return tf.cast(image, tf.float32)
+        return _decode_and_resize(image, self.img_out_size)
+
+    def _parse_example(self, serialized):
+        """Extract the encoded image and its label from a tf.train.Example."""
+        features = tf.parse_single_example(serialized, features={
+            'image/encoded': tf.FixedLenFeature([], tf.string),
+            'image/class/label': tf.FixedLenFeature([], tf.int64),
+        })
+        label = tf.cast(features['image/class/label'], tf.int32)
+        return features['image/encoded'], label
+
+    def _parse_function_train(self, image, label):
+        """Input parser for samples of the training set."""
+        # convert label number into one-hot-encoding
+        one_hot = tf.one_hot(label, self.num_classes)
+
+        # preprocess the image
+        img_resized = self._decode_function(image)
+
+        # with uint8 transport the model subtracts the mean, augmented batches
+        # are normalized after the augmentation
+        if self.transport == 'uint8' or self.augment:
+            return img_resized, one_hot
+
+        img_centered = _normalize_images(img_resized, self.mean)
 
         # RGB -> BGR
         # img_bgr = img_centered[:, :, ::-1]
 
         return img_centered, one_hot
 
-    def _parse_function_inference(self, filename, label):
+    def _augment_batch(self, images, labels):
+        """Augment a batch of uint8 images with one kernel per op for the whole batch."""
+        config = self.augment_config
+        batch_size = tf.shape(images)[0]
+        images = tf.cast(images, tf.float32)
+
+        # random crop and scale: one box per image, resized back to img_out_size.
+        # Swapping the x coordinates of a box mirrors the crop, so the flip is free
+        side = tf.sqrt(tf.random_uniform([batch_size], config['min_scale'], 1.0))
+        y1 = tf.random_uniform([batch_size]) * (1.0 - side)
+        x1 = tf.random_uniform([batch_size]) * (1.0 - side)
+        y2, x2 = y1 + side, x1 + side
+        if config['flip']:
+            flip = tf.random_uniform([batch_size]) < 0.5
+            x1, x2 = tf.where(flip, x2, x1), tf.where(flip, x1, x2)
+        boxes = tf.stack([y1, x1, y2, x2], axis=1)
+        images = tf.image.crop_and_resize(images, boxes, tf.range(batch_size), [self.img_out_size, self.img_out_size])
+
+        # color jitter with per image factors, broadcast over the pixels
+        def factor(max_delta):
+            return tf.random_uniform([batch_size, 1, 1, 1], 1.0 - max_delta, 1.0 + max_delta)
+
+        images += tf.random_uniform([batch_size, 1, 1, 1], -config['brightness'], config['brightness'])
+        mean = tf.reduce_mean(images, axis=[1, 2, 3], keepdims=True)
+        images = (images - mean) * factor(config['contrast']) + mean
+        gray = tf.reduce_sum(images * [0.299, 0.587, 0.114], axis=3, keepdims=True)
+        images = (images - gray) * factor(config['saturation']) + gray
+        images = tf.clip_by_value(images, 0.0, 255.0)
+
+        # with uint8 transport the model subtracts the mean
+        if self.transport == 'uint8':
+            return tf.cast(tf.round(images), tf.uint8), labels
+        return _normalize_images(images, self.mean), labels
+
+    def _stamp_batch(self, images, labels):
+        """Record the time a batch is ready, just before it enters the prefetch buffer."""
+        def _record():
+            self.batch_ready_times.append(time.time())
+            return np.int64(len(self.batch_ready_times))
+
+        stamp = tf.py_func(_record, [], tf.int64)
+        with tf.control_dependencies([stamp]):
+            return tf.identity(images), tf.identity(labels)
+
+    def _parse_function_inference(self, image, label):
         """Input parser for samples of the validation/test set."""
         # convert label number into one-hot-encoding
         one_hot = tf.one_hot(label, self.num_classes)
 
-        # load and preprocess the image
-        img_string = tf.read_file(filename)
-        img_decoded = tf.image.decode_png(img_string, channels=3)
-        img_resized = tf.image.resize_images(img_decoded, [self.img_out_size, self.img_out_size])
-        img_centered = tf.subtract(img_resized, IMAGENET_MEAN)
+        # preprocess the image
+        img_resized = self._decode_function(image)
+
+        # with uint8 transport the model subtracts the mean
+        if self.transport == 'uint8':
+            return img_resized, one_hot
+
+        img_centered = _normalize_images(img_resized, self.mean)
 
         # RGB -> BGR
         # img_bgr = img_centered[:, :, ::-1]
@@ -138,15 +920,1003 @@ class ImageDataGenerator(object):
         return img_centered, one_hot
 
 
-def _load_initial_weights(session, weightPath, train_layers):
-    print("parameters loading ...")
+def feedable_iterator(iterator, variable_size=False):
+    """Create an iterator that reads from whichever iterator's handle is fed.
+
+    The returned batch tensors can be passed to a model as its `inputs`, so
+    training and validation batches go straight into the graph. Switch
+    between datasets by feeding `sess.run(other_iterator.string_handle())`
+    into the handle placeholder.
+    Args:
+        iterator: One of the iterators to switch between. All of them must
+            have the same output types and shapes.
+        variable_size: Leave the height and width of the images undefined, so
+            iterators of different img_out_size can be switched between.
+    Returns:
+        The string handle placeholder and the next batch tensors.
+    """
+    output_shapes = iterator.output_shapes
+    if variable_size:
+        images_shape, labels_shape = output_shapes
+        output_shapes = (tf.TensorShape([None, None, None, images_shape[-1]]), labels_shape)
+    handle = tf.placeholder(tf.string, shape=[], name="iterator_handle")
+    feedable = tf.data.Iterator.from_string_handle(handle, iterator.output_types, output_shapes)
+    return handle, feedable.get_next()
+
+
+def parse_resolution_schedule(schedule, default_size):
+    """Parse a progressive resolution schedule.
+
+    Early steps train on small images, which are cheaper to decode and to
+    run through the network, and the resolution grows towards the one the
+    model is evaluated at.
+    Args:
+        schedule: Comma separated "step:size" pairs, e.g. "0:128,400:160,800:224".
+            From `step` on, training images are resized to `size`. Empty for
+            a single stage at default_size.
+        default_size: The image size when no schedule is given.
+    Returns:
+        A list of (first_step, size) sorted by first_step.
+    """
+    if not schedule:
+        return [(0, default_size)]
+    stages = sorted((int(step), int(size)) for step, size in (item.split(':') for item in schedule.split(',')))
+    if stages[0][0] != 0:
+        raise ValueError("The resolution schedule has to start at step 0, got {}".format(schedule))
+    return stages
+
+
+def resolution_stage(schedule, step):
+    """Return the index of the stage of a parsed schedule that is active at `step`."""
+    return max(i for i, (first_step, _) in enumerate(schedule) if first_step <= step)
+
+
+def save_input_state(checkpoint_path, seed, position, last_checkpoints=None):
+    """Store the position of the training input next to a model checkpoint.
+    Args:
+        checkpoint_path: Path of the checkpoint, as returned by `saver.save`.
+        seed: The seed of the training ImageDataGenerator.
+        position: Number of training samples consumed so far.
+        last_checkpoints: The `last_checkpoints` of the saver. The input
+            states of the other checkpoints of the directory are removed once
+            the saver rotated their checkpoint files out. After a restore,
+            let the saver `recover_last_checkpoints` first.
+    """
+    with open(checkpoint_path + ".input.json", 'w') as f:
+        json.dump({'seed': int(seed), 'position': int(position)}, f)
+
+    # the saver rotates old checkpoints out, their input states go with them
+    if last_checkpoints is not None:
+        kept = set(os.path.abspath(path) for path in last_checkpoints)
+        for state_path in glob.glob(os.path.join(os.path.dirname(os.path.abspath(checkpoint_path)), "*.input.json")):
+            path = state_path[:-len(".input.json")]
+            # a checkpoint the saver does not track (any more) is kept as long as its files are
+            if path not in kept and not os.path.exists(path + ".index") and not os.path.exists(path):
+                os.remove(state_path)
+
+
+def load_input_state(checkpoint_path):
+    """Return the (seed, position) stored with `save_input_state`.
+
+    Pass them as `seed` and `start_position` to the training
+    ImageDataGenerator to continue reading where the checkpoint was taken.
+    `checkpoint_path` is None when tf.train.latest_checkpoint found no
+    checkpoint to resume from.
+    """
+    if checkpoint_path is None:
+        raise ValueError("No checkpoint to resume from, check that resume_dir is the directory of a run with a saved checkpoint")
+    with open(checkpoint_path + ".input.json", 'r') as f:
+        state = json.load(f)
+    return state['seed'], state['position']
+
+
+def benchmark_input_pipeline(txt_file, source='text', img_out_size=224, batch_size=128, num_batches=20,
+                             pipeline_config=None):
+    """Measure the throughput of the input pipeline alone, stage by stage.
+
+    Every stage is timed as a prefix of the pipeline: reading the files,
+    then also decoding, resizing and normalizing them, each with the map
+    parallelism of the config, and finally the complete batched pipeline of
+    an ImageDataGenerator. The time a stage adds per image is the difference
+    to the prefix before it. Each run of a prefix pulls `batch_size` images
+    through it but only returns one of them, so the timings are not
+    dominated by `sess.run`.
+    Args:
+        txt_file: The manifest, or the shard index with source='tfrecord'.
+        source: Either 'text' or 'tfrecord', see ImageDataGenerator.
+        img_out_size: Height and width of the images in the batches.
+        batch_size: Number of images per batch.
+        num_batches: Number of batches timed per stage.
+        pipeline_config: The pipeline config of the ImageDataGenerator, or
+            'autotune'.
+    Returns:
+        A JSON serializable dict with the host, the settings, the images/sec
+        of the complete pipeline and, per stage, the images/sec of the prefix
+        ending with it and the milliseconds per image it adds.
+    """
+    generator = ImageDataGenerator(txt_file=txt_file,
+                                   mode='inference',
+                                   batch_size=batch_size,
+                                   num_classes=1,
+                                   shuffle=False,
+                                   img_out_size=img_out_size,
+                                   source=source,
+                                   pipeline_config=pipeline_config)
+    num_parallel_calls = generator.pipeline_config['num_parallel_calls']
 
-    reader = pywrap_tensorflow.NewCheckpointReader(weightPath)
+    # decoded images differ in size, so only their shape is returned
+    stages = [('read', lambda image: image),
+              ('decode', lambda image: tf.shape(_decode_image(image, img_out_size))),
+              ('resize', lambda image: _decode_and_resize(image, img_out_size)),
+              ('normalize', lambda image: _normalize_images(_decode_and_resize(image, img_out_size)))]
+    prefixes = []
+    for name, stage in stages:
+        data = generator._make_source_dataset(source, False, None)
+        data = data.map(lambda image, label, stage=stage: stage(image), num_parallel_calls=num_parallel_calls)
+        prefixes.append((name, data.repeat().shard(batch_size, 0).make_one_shot_iterator().get_next()))
+    prefixes.append(('batch', generator.iterator.get_next()))
 
-    # Load the weights into memory
-    var_to_shape_map = reader.get_variable_to_shape_map()
+    report = {'host': platform.node(),
+              'txt_file': txt_file,
+              'source': source,
+              'img_out_size': img_out_size,
+              'batch_size': batch_size,
+              'num_batches': num_batches,
+              'pipeline_config': generator.pipeline_config,
+              'stages': []}
+    previous = 0.0
+    with tf.Session() as sess:
+        for name, next_element in prefixes:
+            # the first run pays for starting the threads
+            sess.run(next_element)
+            start = time.time()
+            for _ in range(num_batches):
+                sess.run(next_element)
+            seconds_per_image = (time.time() - start) / (num_batches * batch_size)
+            report['stages'].append({'stage': name,
+                                     'images_per_sec': 1.0 / seconds_per_image,
+                                     'ms_per_image': 1000.0 * max(seconds_per_image - previous, 0.0)})
+            previous = seconds_per_image
+    report['images_per_sec'] = report['stages'][-1]['images_per_sec']
+    return report
 
-    for op_name in var_to_shape_map:
+
+def _normalize_images(images, mean=None):
+    """Convert images to float and subtract the dataset mean.
+
+    Used by the input pipeline for 'float32' transport and by the models for
+    uint8 input, so both apply exactly the same normalization.
+    Args:
+        images: Images with the RGB channels last.
+        mean: Per-channel mean, e.g. from `compute_dataset_stats`. Defaults
+            to IMAGENET_MEAN.
+    """
+    mean = tf.constant(IMAGENET_MEAN if mean is None else mean, dtype=tf.float32)
+    return tf.subtract(tf.cast(images, tf.float32), mean)
+
+
+def _decode_jpeg(img_string, img_out_size):
+    """Decode a JPEG, downscaled in the DCT domain when it is much larger than needed.
+
+    libjpeg can decode at 1/2, 1/4 or 1/8 of the full resolution for a
+    fraction of the cost. The largest ratio is picked that still leaves the
+    shorter side at least `img_out_size`, so the following resize only ever
+    shrinks the image.
+    """
+    shape = tf.image.extract_jpeg_shape(img_string)
+    min_side = tf.minimum(shape[0], shape[1])
+    branches = [(tf.greater_equal(min_side, ratio * img_out_size),
+                 lambda ratio=ratio: tf.image.decode_jpeg(img_string, channels=3, ratio=ratio))
+                for ratio in [8, 4, 2]]
+    return tf.case(branches, default=lambda: tf.image.decode_jpeg(img_string, channels=3), exclusive=False)
+
+
+def _decode_image(img_string, img_out_size):
+    """Decode an encoded image whose format (JPEG, BMP or PNG) is detected from its magic bytes.
+
+    JPEGs are downscaled while decoding, see `_decode_jpeg`.
+    """
+    is_jpeg = tf.image.is_jpeg(img_string)
+    is_bmp = tf.equal(tf.substr(img_string, 0, 2), b'BM')
+    img_decoded = tf.case([(is_jpeg, lambda: _decode_jpeg(img_string, img_out_size)),
+                           (is_bmp, lambda: tf.image.decode_bmp(img_string, channels=3))],
+                          default=lambda: tf.image.decode_png(img_string, channels=3),
+                          exclusive=False)
+    img_decoded.set_shape([None, None, 3])
+    return img_decoded
+
+
+def _decode_and_resize(img_string, img_out_size):
+    """Decode an encoded image and resize it to `img_out_size` x `img_out_size`."""
+    return tf.image.resize_images(_decode_image(img_string, img_out_size), [img_out_size, img_out_size])
+
+
+def _decode_to_uint8(img_string, img_out_size):
+    """Decode and resize an encoded image, rounded back to uint8 for caching."""
+    return tf.cast(tf.round(_decode_and_resize(img_string, img_out_size)), tf.uint8)
+
+
+def _opencv_decode_worker(tasks, done, buffer, ring_shape, img_paths, img_out_size):
+    """Decode and resize batches of images into the shared ring, in a worker process.
+
+    Args:
+        tasks: Queue of (slot, sample indices), None to stop.
+        done: Queue the (slot, error message or None) of every finished batch
+            is put into.
+        buffer: The shared memory of the ring.
+        ring_shape: Shape of the ring, [slots, batch, height, width, 3].
+        img_paths: Paths of all samples of the manifest.
+        img_out_size: Height and width of the resized images.
+    """
+    import cv2
+    # the processes already run in parallel
+    cv2.setNumThreads(1)
+    ring = np.frombuffer(buffer, dtype=np.uint8).reshape(ring_shape)
+    for slot, indices in iter(tasks.get, None):
+        error = None
+        # any failure is reported with the slot, the consumer waits for every slot it submitted
+        try:
+            for i, index in enumerate(indices):
+                image = cv2.imread(img_paths[index], cv2.IMREAD_COLOR)
+                if image is None:
+                    error = "Can not decode {}".format(img_paths[index])
+                    break
+                # bilinear like `_decode_and_resize`, written straight into the slot as RGB
+                if image.shape[:2] != (img_out_size, img_out_size):
+                    image = cv2.resize(image, (img_out_size, img_out_size), interpolation=cv2.INTER_LINEAR)
+                cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=ring[slot, i])
+        except Exception as e:
+            error = "Decoding a batch failed: {!r}".format(e)
+        finally:
+            done.put((slot, error))
+
+
+class InputMonitor(object):
+    """Measure how much of the training step time is spent waiting for input.
+
+    The training ImageDataGenerator has to be created with monitor=True, so
+    it records when each of its batches is ready. A step waited for its
+    batch as long as the batch got ready after the step started, and the
+    number of ready but unconsumed batches at the start of a step is the
+    fill level of the prefetch buffer.
+    """
+
+    def __init__(self, input_bound_threshold=0.2):
+        """Create a new InputMonitor.
+        Args:
+            input_bound_threshold: Fraction of the step time waiting for
+                input above which a reporting interval is flagged as input
+                bound.
+        """
+        self.input_bound_threshold = input_bound_threshold
+        self._reset()
+
+    def _reset(self):
+        self._step_time = 0.0
+        self._wait_time = 0.0
+        self._fill_levels = []
+
+    def run(self, sess, generator, fetches, feed_dict=None):
+        """Run a step that reads one batch of `generator` and account for its input wait."""
+        self._fill_levels.append(len(generator.batch_ready_times))
+        start = time.time()
+        results = sess.run(fetches, feed_dict=feed_dict)
+        end = time.time()
+
+        ready = generator.batch_ready_times.popleft()
+        self._step_time += end - start
+        self._wait_time += min(max(ready - start, 0.0), end - start)
+        return results
+
+    def report(self, summary_writer, step):
+        """Write the statistics of the steps since the last report to TensorBoard.
+
+        Prints a warning when the interval was input bound.
+        Returns:
+            The fraction of the step time that was spent waiting for input.
+        """
+        wait_fraction = self._wait_time / self._step_time if self._step_time > 0 else 0.0
+        fill_level = float(np.mean(self._fill_levels)) if self._fill_levels else 0.0
+        input_bound = wait_fraction > self.input_bound_threshold
+        summary = tf.Summary(value=[tf.Summary.Value(tag="input/wait_fraction", simple_value=wait_fraction),
+                                    tf.Summary.Value(tag="input/prefetch_fill", simple_value=fill_level),
+                                    tf.Summary.Value(tag="input/input_bound", simple_value=float(input_bound))])
+        summary_writer.add_summary(summary, step)
+        if input_bound:
+            print("input bound: {:.0%} of the step time was spent waiting for data, "
+                  "{:.1f} batches prefetched on average".format(wait_fraction, fill_level))
+        self._reset()
+        return wait_fraction
+
+
+class SampleCache(object):
+    """In-memory cache of decoded and resized images with a byte budget.
+
+    Entries are evicted least-recently-used first once the budget is exceeded.
+    `lookup` and `insert` are called from `tf.py_func` by the parallel map of
+    the input pipeline, so they are guarded by a lock.
+    """
+
+    def __init__(self, max_bytes, compress=False):
+        """Create a new SampleCache.
+        Args:
+            max_bytes: Maximum number of bytes held by the cached images.
+            compress: Whether to store the images PNG encoded instead of as
+                raw uint8 arrays. Costs a PNG decode per hit, but more
+                images fit into the budget.
+        """
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key):
+        """Return (True, image) for a cached key and (False, empty image) otherwise."""
+        import cv2
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, np.zeros((0, 0, 3), dtype=np.uint8)
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        value, _ = entry
+        if self.compress:
+            value = cv2.imdecode(np.frombuffer(value, np.uint8), cv2.IMREAD_UNCHANGED)
+        return True, value
+
+    def insert(self, key, image):
+        """Cache an image, evicting the least recently used ones if needed."""
+        import cv2
+        value = cv2.imencode('.png', image)[1].tobytes() if self.compress else image.copy()
+        size = len(value) if self.compress else value.nbytes
+        if size > self.max_bytes:
+            return image
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size)
+                self.num_bytes += size
+                while self.num_bytes > self.max_bytes:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self.num_bytes -= evicted_size
+        return image
+
+
+def _index_lines(txt_file, chunk_size=1 << 24):
+    """Return the byte offset of every line start of a file, followed by the file size.
+
+    The file is scanned in chunks, so memory use is 8 bytes per line.
+    """
+    offsets = [np.zeros(1, dtype=np.int64)]
+    position = 0
+    with open(txt_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord('\n'))
+            offsets.append(newlines.astype(np.int64) + position + 1)
+            position += len(chunk)
+    offsets = np.concatenate(offsets)
+
+    # the last line has no trailing newline
+    if offsets[-1] != position:
+        offsets = np.append(offsets, position)
+    return offsets
+
+
+def _manifest_name(txt_file):
+    """Name of a manifest within a shared directory: its base name and a hash of its absolute path.
+
+    Manifests with the same base name in different directories (data/a/train.txt
+    and data/b/train.txt) so never share, nor clean up, each other's files.
+    """
+    name = os.path.splitext(os.path.basename(txt_file))[0]
+    return "{}-{}".format(name, hashlib.sha1(os.path.abspath(txt_file).encode("utf-8")).hexdigest()[:8])
+
+
+def _image_cache_key(txt_file, img_out_size):
+    """Hash the manifest contents together with the preprocessing config."""
+    sha = hashlib.sha1()
+    with open(txt_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    sha.update("{}-{}".format(IMAGE_CACHE_VERSION, img_out_size).encode("utf-8"))
+    return sha.hexdigest()[:16]
+
+
+def build_image_cache(txt_file, cache_dir, img_out_size=224, batch_size=64):
+    """Store the decoded and resized images of a manifest in one uint8 file.
+
+    The images are written in manifest order to a raw memory-mapped array of
+    shape [num_images, img_out_size, img_out_size, 3], together with an
+    index holding the "path label" line of every image. The file names carry
+    a hash of the manifest path (see `_manifest_name`) and a hash of its
+    contents and of the preprocessing config, so the cache is rebuilt (and
+    the stale one of the same manifest removed) whenever either changes.
+    Images are rounded to uint8 after resizing.
+
+    Args:
+        txt_file: Path to the image manifest (one "path label" per line).
+        cache_dir: Directory the cache and its index are written to.
+        img_out_size: Height and width of the cached images.
+        batch_size: Number of images decoded per session call while building.
+    Returns:
+        The paths of the cache file and of its index.
+    """
+    prefix = os.path.join(cache_dir, "{}-{}".format(_manifest_name(txt_file), img_out_size))
+    key = _image_cache_key(txt_file, img_out_size)
+    cache_path = "{}-{}.uint8".format(prefix, key)
+    index_path = "{}-{}.txt".format(prefix, key)
+
+    # the index is written last, so its presence marks a complete cache
+    if os.path.exists(index_path):
+        return cache_path, index_path
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    for stale_path in glob.glob("{}-*.uint8".format(prefix)) + glob.glob("{}-*.txt".format(prefix)):
+        os.remove(stale_path)
+
+    with open(txt_file, 'r') as f:
+        lines = [line.rstrip("\n") for line in f if line.strip()]
+    img_paths = [line.split(' ')[0] for line in lines]
+
+    print("building image cache {} ...".format(cache_path))
+    images = np.memmap(cache_path + ".tmp", dtype=np.uint8, mode='w+',
+                       shape=(len(img_paths), img_out_size, img_out_size, 3))
+
+    # decode with the same ops as the input pipeline, in a graph of its own
+    with tf.Graph().as_default():
+        data = tf.data.Dataset.from_tensor_slices(convert_to_tensor(img_paths, dtype=dtypes.string))
+        data = data.map(lambda filename: _decode_to_uint8(tf.read_file(filename), img_out_size),
+                        num_parallel_calls=multiprocessing.cpu_count())
+        data = data.batch(batch_size).prefetch(1)
+        next_batch = data.make_one_shot_iterator().get_next()
+
+        with tf.Session() as sess:
+            offset = 0
+            while offset < len(img_paths):
+                batch = sess.run(next_batch)
+                images[offset:offset + len(batch)] = batch
+                offset += len(batch)
+
+    images.flush()
+    del images
+    os.rename(cache_path + ".tmp", cache_path)
+
+    with open(index_path, 'w') as index:
+        for line in lines:
+            index.write(line + "\n")
+
+    return cache_path, index_path
+
+
+def _scan_image(path):
+    """Validate an image file for `build_image_index`.
+
+    An image is usable when it has a format the input pipeline decodes and
+    decodes with OpenCV. Bytes after the end of a JPEG, which many cameras
+    append, do not matter. Only a JPEG without any end marker is taken as
+    truncated, as OpenCV decodes those partially where TF rejects them.
+    Returns:
+        The (format, height, width, num_bytes) record of the image, with
+        format 0 when it is unusable.
+    """
+    import cv2
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        image_format = _image_format(data)
+    except (IOError, OSError, ValueError):
+        return 0, 0, 0, 0
+    if image_format not in IMAGE_INDEX_FORMATS:
+        return 0, 0, 0, len(data)
+
+    truncated = image_format == b'jpeg' and b'\xff\xd9' not in data
+    image = None if truncated else cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return 0, 0, 0, len(data)
+    return IMAGE_INDEX_FORMATS.index(image_format) + 1, image.shape[0], image.shape[1], len(data)
+
+
+def build_image_index(txt_file, num_workers=None):
+    """Validate every entry of a manifest and record the metadata of its image.
+
+    The images are scanned once by a pool of processes. The index holds one
+    IMAGE_INDEX_DTYPE record (format, height, width and number of bytes, 17
+    bytes) per manifest line, in manifest order, and is saved as a .npy file
+    next to the manifest. Its name carries a hash of the manifest contents,
+    so the index is rebuilt (and the stale one removed) whenever the manifest
+    changes. Pass it as `image_index` to ImageDataGenerator.
+
+    Args:
+        txt_file: Path to the image manifest (one "path label" per line).
+        num_workers: Number of scanning processes, defaults to the number of
+            CPUs.
+    Returns:
+        The path of the index.
+    """
+    index_path = _image_index_path(txt_file)
+    if os.path.exists(index_path):
+        return index_path
+    for stale_path in glob.glob("{}-index-*.npy".format(os.path.splitext(txt_file)[0])):
+        os.remove(stale_path)
+
+    with open(txt_file, 'r') as f:
+        img_paths = [line.split(' ')[0] for line in f.readlines()]
+
+    print("scanning {} images of {} ...".format(len(img_paths), txt_file))
+    pool = multiprocessing.Pool(num_workers or multiprocessing.cpu_count())
+    try:
+        index = np.array(pool.map(_scan_image, img_paths, chunksize=64), dtype=np.uint64)
+    finally:
+        pool.close()
+        pool.join()
+    records = np.zeros(len(img_paths), dtype=IMAGE_INDEX_DTYPE)
+    for i, name in enumerate(IMAGE_INDEX_DTYPE.names):
+        records[name] = index[:, i] if len(index) else 0
+
+    num_invalid = int((records['format'] == 0).sum())
+    if num_invalid:
+        print("{} of {} images are unusable".format(num_invalid, len(records)))
+
+    _save_image_index(index_path, records)
+    return index_path
+
+
+def _image_index_path(txt_file, digest=None):
+    """Path of the image index of a manifest, named after the hash of its contents.
+
+    Pass `digest` (the first 16 hex digits of the SHA-1 of the contents) for
+    a manifest that is not written yet.
+    """
+    if digest is None:
+        sha = hashlib.sha1()
+        with open(txt_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()[:16]
+    return "{}-index-{}.npy".format(os.path.splitext(txt_file)[0], digest)
+
+
+def _save_image_index(index_path, records):
+    """Save an image index under a temporary name first, so an existing index is always complete."""
+    np.save(index_path + ".tmp.npy", records)
+    os.rename(index_path + ".tmp.npy", index_path)
+
+
+def _resized_store_prefix(txt_file, store_dir, img_out_size):
+    """Path prefix of the resized store of a manifest, without the hash of its contents."""
+    return os.path.join(store_dir, "{}-{}".format(_manifest_name(txt_file), img_out_size))
+
+
+def resized_store_manifest(txt_file, store_dir, img_out_size):
+    """Return the manifest of the resized store of `txt_file` at `img_out_size`, None if it was not built."""
+    prefix = _resized_store_prefix(txt_file, store_dir, img_out_size)
+    manifest_path = "{}-{}-png.txt".format(prefix, _image_cache_key(txt_file, img_out_size))
+    return manifest_path if os.path.exists(manifest_path) else None
+
+
+def build_resized_store(txt_file, store_dir, img_out_size=224, batch_size=64, num_workers=None):
+    """Write the images of a manifest resized to `img_out_size` x `img_out_size`.
+
+    The images are validated once by a pool of processes (see `_scan_image`),
+    then decoded and resized by the ops of the input pipeline
+    (`_decode_to_uint8`, the images of transport='uint8') and stored
+    losslessly as PNG. A run reading the store gets the same pixels as one
+    reading the originals, but decodes a fraction of them and resizes none.
+    Next to the images a manifest pointing at them and its image index (see
+    `build_image_index`) are written, the manifest last, so its presence
+    marks a complete store. Unusable images are left out. The names carry a
+    hash of the path of the original manifest (see `_manifest_name`) and a
+    hash of its contents and of the preprocessing, so the store is rebuilt
+    (and the stale one of the same manifest removed) whenever either changes.
+    ImageDataGenerator finds the store by itself when passed the same
+    `store_dir`.
+
+    Args:
+        txt_file: Path to the image manifest (one "path label" per line).
+        store_dir: Directory the stores are written to.
+        img_out_size: Height and width of the stored images, the
+            default_image_size of the models that will read them.
+        batch_size: Number of images resized per session call.
+        num_workers: Number of scanning processes, defaults to the number
+            of CPUs.
+    Returns:
+        The path of the manifest of the store.
+    """
+    prefix = _resized_store_prefix(txt_file, store_dir, img_out_size)
+    key = _image_cache_key(txt_file, img_out_size)
+    manifest_path = "{}-{}-png.txt".format(prefix, key)
+    image_dir = "{}-{}-png".format(prefix, key)
+    if os.path.exists(manifest_path):
+        return manifest_path
+
+    for stale_path in glob.glob("{}-*".format(prefix)):
+        if os.path.isdir(stale_path):
+            for stale_image in glob.glob(os.path.join(stale_path, "*.jpg")) + glob.glob(os.path.join(stale_path, "*.png")):
+                os.remove(stale_image)
+            os.rmdir(stale_path)
+        else:
+            os.remove(stale_path)
+    os.makedirs(image_dir)
+
+    with open(txt_file, 'r') as f:
+        lines = [line.rstrip("\n").split(' ') for line in f.readlines()]
+
+    print("scanning {} images of {} ...".format(len(lines), txt_file))
+    pool = multiprocessing.Pool(num_workers or multiprocessing.cpu_count())
+    try:
+        scanned = pool.map(_scan_image, [items[0] for items in lines], chunksize=64)
+    finally:
+        pool.close()
+        pool.join()
+    kept = [i for i, record in enumerate(scanned) if record[0] > 0]
+    if len(kept) < len(lines):
+        print("left out {} unusable images of {}".format(len(lines) - len(kept), len(lines)))
+    dst_paths = [os.path.join(image_dir, "{:08d}.png".format(i)) for i in kept]
+
+    # resize with the same ops as the input pipeline, in a graph of its own
+    print("resizing {} images of {} to {} ...".format(len(kept), txt_file, img_out_size))
+    num_bytes = []
+    with tf.Graph().as_default():
+        data = tf.data.Dataset.from_tensor_slices(convert_to_tensor([lines[i][0] for i in kept], dtype=dtypes.string))
+        data = data.map(lambda filename: tf.image.encode_png(_decode_to_uint8(tf.read_file(filename), img_out_size)),
+                        num_parallel_calls=multiprocessing.cpu_count())
+        data = data.batch(batch_size).prefetch(1)
+        next_batch = data.make_one_shot_iterator().get_next()
+
+        with tf.Session() as sess:
+            while len(num_bytes) < len(kept):
+                for encoded in sess.run(next_batch):
+                    with open(dst_paths[len(num_bytes)], 'wb') as f:
+                        f.write(encoded)
+                    num_bytes.append(len(encoded))
+
+    index = np.zeros(len(kept), dtype=IMAGE_INDEX_DTYPE)
+    index['format'] = IMAGE_INDEX_FORMATS.index(b'png') + 1
+    index['height'] = img_out_size
+    index['width'] = img_out_size
+    index['num_bytes'] = num_bytes
+
+    contents = "".join("{} {}\n".format(dst_path, lines[i][1]) for dst_path, i in zip(dst_paths, kept)).encode("utf-8")
+    _save_image_index(_image_index_path(manifest_path, hashlib.sha1(contents).hexdigest()[:16]), index)
+    with open(manifest_path + ".tmp", 'wb') as f:
+        f.write(contents)
+    os.rename(manifest_path + ".tmp", manifest_path)
+    return manifest_path
+
+
+def _read_varint(data, position):
+    """Decode the varint at `position` of `data`, return it and the position after it."""
+    result = shift = 0
+    while True:
+        byte = ord(data[position:position + 1])
+        result |= (byte & 0x7f) << shift
+        position += 1
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+
+
+def _read_table_block(data, offset, size):
+    """Return the (key, value) entries of an uncompressed block of a LevelDB-style table."""
+    # a block is followed by its compression type and checksum
+    if ord(data[offset + size:offset + size + 1]) != 0:
+        raise ValueError("Compressed checkpoint index blocks are not supported")
+    block = data[offset:offset + size]
+    num_restarts = struct.unpack('<I', block[-4:])[0]
+    end = len(block) - 4 * (num_restarts + 1)
+
+    entries = []
+    key = b''
+    position = 0
+    while position < end:
+        shared, position = _read_varint(block, position)
+        non_shared, position = _read_varint(block, position)
+        value_length, position = _read_varint(block, position)
+        key = key[:shared] + block[position:position + non_shared]
+        position += non_shared
+        entries.append((key, block[position:position + value_length]))
+        position += value_length
+    return entries
+
+
+def _read_bundle_index(checkpoint_path):
+    """Read the tensor entries of the index of a V2 checkpoint.
+
+    The index is a table of BundleEntryProtos (dtype, shape, shard, offset
+    and size of every tensor), keyed by the tensor names.
+    Returns:
+        A dict of the BundleEntryProtos by name and the number of data shards.
+    """
+    with open(checkpoint_path + ".index", 'rb') as f:
+        data = f.read()
+    # the footer holds the handles of the metaindex and of the index block
+    footer = data[-48:]
+    if struct.unpack('<Q', footer[-8:])[0] != 0xdb4775248b80fb57:
+        raise ValueError("{} is not a checkpoint index".format(checkpoint_path + ".index"))
+    _, position = _read_varint(footer, 0)
+    _, position = _read_varint(footer, position)
+    index_offset, position = _read_varint(footer, position)
+    index_size, _ = _read_varint(footer, position)
+
+    entries = {}
+    num_shards = 1
+    for _, handle in _read_table_block(data, index_offset, index_size):
+        block_offset, position = _read_varint(handle, 0)
+        block_size, _ = _read_varint(handle, position)
+        for key, value in _read_table_block(data, block_offset, block_size):
+            # the empty key holds the header of the bundle
+            if not key:
+                header = tensor_bundle_pb2.BundleHeaderProto()
+                header.ParseFromString(value)
+                num_shards = header.num_shards
+                continue
+            entry = tensor_bundle_pb2.BundleEntryProto()
+            entry.ParseFromString(value)
+            entries[key.decode("utf-8")] = entry
+    return entries, num_shards
+
+
+def _page_in(data):
+    """Touch every memory page of a byte array, so the pages are read from disk."""
+    if len(data):
+        data[::mmap.PAGESIZE].max()
+
+
+def _read_checkpoint_tensors(checkpoint_path, names, num_threads=8, chunk_bytes=1 << 24):
+    """Return the values of the checkpoint tensors that can be memory-mapped, by name.
+
+    Numeric tensors of a V2 checkpoint are numpy views of its memory-mapped
+    data shards, so no copy of the checkpoint is made in memory before the
+    values are fed. The views are paged in by a thread pool in chunks of
+    `chunk_bytes`, so the reads overlap and scale with the disk bandwidth
+    rather than with a single reader. The crc32c of every tensor recorded in
+    the bundle is then verified by the same pool, so a corrupt shard raises
+    a ValueError as NewCheckpointReader would. This needs the crc32c
+    package; without it nothing is mapped. The mapping is copy-on-write, the
+    file is never written. Tensors of V1 checkpoints, string and sliced
+    tensors are left out, `_load_initial_weights` restores them with its
+    restore ops.
+
+    The pretrained checkpoints this repo downloads (vgg_16.ckpt,
+    inception_v1.ckpt, ...) are single-file V1 checkpoints, so none of their
+    tensors are mapped here. Their fast path is a flat weight file written
+    once by convert_weights.py and passed as `weights_path`.
+    """
+    try:
+        import crc32c
+    except ImportError:
+        # the checksums cannot be verified, leave every tensor to the restore ops, which do
+        return {}
+
+    try:
+        entries, num_shards = _read_bundle_index(checkpoint_path)
+    except (IOError, OSError, ValueError):
+        entries, num_shards = {}, 1
+
+    shards = {}
+    values = {}
+    pool = ThreadPool(num_threads)
+    try:
+        for name in names:
+            entry = entries.get(name)
+            dtype = tf.as_dtype(entry.dtype) if entry is not None else None
+            if entry is None or len(entry.slices) or dtype == tf.string:
+                continue
+            if entry.shard_id not in shards:
+                shard_path = "{}.data-{:05d}-of-{:05d}".format(checkpoint_path, entry.shard_id, num_shards)
+                shards[entry.shard_id] = np.memmap(shard_path, dtype=np.uint8, mode='c')
+            data = shards[entry.shard_id][entry.offset:entry.offset + entry.size]
+            values[name] = data.view(dtype.as_numpy_dtype).reshape([dim.size for dim in entry.shape.dim])
+
+        chunks = [data[i:i + chunk_bytes] for data in (values[name].reshape(-1).view(np.uint8) for name in values)
+                  for i in range(0, data.nbytes, chunk_bytes)]
+        pool.map(_page_in, chunks)
+
+        # the entries hold the masked crc32c of the tensor bytes
+        names = list(values)
+        for name, crc in zip(names, pool.map(lambda name: crc32c.crc32c(values[name].reshape(-1).view(np.uint8)), names)):
+            if (((crc >> 15) | (crc << 17)) + 0xa282ead8) & 0xffffffff != entries[name].crc32c:
+                raise ValueError("Checksum mismatch of the tensor {} of {}".format(name, checkpoint_path))
+    finally:
+        pool.close()
+        pool.join()
+    return values
+
+
+def flat_weights_path(checkpoint_path):
+    """Return the default path of the flat weight file converted from a checkpoint."""
+    if checkpoint_path.endswith(".ckpt"):
+        checkpoint_path = checkpoint_path[:-len(".ckpt")]
+    return checkpoint_path + ".weights"
+
+
+def _is_flat_weights(path):
+    """Return whether `path` is a flat weight file of `convert_checkpoint_weights`."""
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(FLAT_WEIGHTS_MAGIC)) == FLAT_WEIGHTS_MAGIC
+
+
+def _checkpoint_fingerprint(checkpoint_path):
+    """Return the path, size and modification time of a checkpoint, None if it does not exist.
+
+    A V1 checkpoint is a single file, a V2 checkpoint is fingerprinted by its
+    .index file, which is rewritten with every save.
+    """
+    for path in [checkpoint_path, checkpoint_path + ".index"]:
+        if os.path.isfile(path):
+            return {'path': os.path.abspath(checkpoint_path), 'size': os.path.getsize(path),
+                    'mtime': int(os.path.getmtime(path))}
+    return None
+
+
+def convert_checkpoint_weights(checkpoint_path, output_path=None, storage_dtype='float32'):
+    """Convert a checkpoint into a flat weight file that is memory-mapped to load.
+
+    The file holds the magic, the length of a JSON header and the header,
+    which records the fingerprint of the source checkpoint (see
+    `_checkpoint_fingerprint`) and the storage_dtype, and indexes the name,
+    dtype, shape, offset and size of every tensor. The tensors follow, each
+    aligned to FLAT_WEIGHTS_ALIGNMENT bytes, so they are read as numpy views
+    of the mapped file without any parsing. Pass the file as `weights_path`
+    to a model to load it instead of the checkpoint.
+    Args:
+        checkpoint_path: the checkpoint to convert.
+        output_path: the weight file to write(default: `flat_weights_path` of
+            the checkpoint).
+        storage_dtype: 'float32', or 'float16' or 'bfloat16' to store the
+            float32 tensors in half the size; they are cast back to float32
+            when loaded. Other tensors are stored as they are.
+    Returns:
+        The path of the weight file.
+    """
+    if storage_dtype not in ('float32', 'float16', 'bfloat16'):
+        raise ValueError("Invalid storage_dtype '{}'.".format(storage_dtype))
+    output_path = output_path or flat_weights_path(checkpoint_path)
+
+    reader = pywrap_tensorflow.NewCheckpointReader(checkpoint_path)
+    tensors = []
+    entries = {}
+    offset = 0
+    for name in sorted(reader.get_variable_to_shape_map()):
+        value = reader.get_tensor(name)
+        if value.dtype == np.object_:
+            continue
+        dtype = stored = value.dtype.name
+        if value.dtype == np.float32 and storage_dtype == 'float16':
+            value, stored = value.astype(np.float16), 'float16'
+        elif value.dtype == np.float32 and storage_dtype == 'bfloat16':
+            # round to the nearest even upper half of the float32 bits
+            bits = value.view(np.uint32).astype(np.uint64)
+            value, stored = ((bits + 0x7fff + ((bits >> 16) & 1)) >> 16).astype(np.uint16), 'bfloat16'
+        value = np.ascontiguousarray(value)
+        entries[name] = {'dtype': dtype, 'stored_dtype': stored,
+                        'shape': list(value.shape), 'offset': offset, 'nbytes': value.nbytes}
+        tensors.append(value)
+        offset += -(-value.nbytes // FLAT_WEIGHTS_ALIGNMENT) * FLAT_WEIGHTS_ALIGNMENT
+
+    header = {'source': _checkpoint_fingerprint(checkpoint_path), 'storage_dtype': storage_dtype, 'tensors': entries}
+    header = json.dumps(header, sort_keys=True).encode("utf-8")
+    data_start = -(-(len(FLAT_WEIGHTS_MAGIC) + 8 + len(header)) // FLAT_WEIGHTS_ALIGNMENT) * FLAT_WEIGHTS_ALIGNMENT
+    # write next to the target and rename, so a reader never sees a partial file
+    temp_path = output_path + ".tmp{}".format(os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(FLAT_WEIGHTS_MAGIC + struct.pack('<Q', len(header)) + header)
+        for value in tensors:
+            f.write(b'\0' * (-f.tell() % FLAT_WEIGHTS_ALIGNMENT))
+            f.write(value.tobytes())
+        f.write(b'\0' * (data_start + offset - f.tell()))
+    os.rename(temp_path, output_path)
+    return output_path
+
+
+def _read_flat_weights_header(path):
+    """Return the header of a flat weight file and the offset of its tensor data."""
+    with open(path, 'rb') as f:
+        if f.read(len(FLAT_WEIGHTS_MAGIC)) != FLAT_WEIGHTS_MAGIC:
+            raise ValueError("{} is not a flat weight file".format(path))
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size).decode("utf-8"))
+    return header, -(-(len(FLAT_WEIGHTS_MAGIC) + 8 + header_size) // FLAT_WEIGHTS_ALIGNMENT) * FLAT_WEIGHTS_ALIGNMENT
+
+
+def load_flat_weights(path):
+    """Return the tensors of a flat weight file by name.
+
+    The tensors are views of the file mapped copy-on-write, except those
+    stored as float16 or bfloat16, which are cast back to float32. Prints a
+    warning when the weights are rounded to half precision, or when the
+    source checkpoint changed since the conversion.
+    """
+    header, data_start = _read_flat_weights_header(path)
+    # the source checkpoint is usually not shipped along with the weight file
+    source = header['source']
+    if source is not None and _checkpoint_fingerprint(source['path']) not in (None, source):
+        print("warning: {} was converted from {}, which changed since, convert it again".format(path, source['path']))
+    if header['storage_dtype'] != 'float32':
+        print("warning: loading the {} rounded weights of {}".format(header['storage_dtype'], path))
+
+    data = np.memmap(path, dtype=np.uint8, mode='c')
+    weights = {}
+    for name, entry in header['tensors'].items():
+        stored = np.uint16 if entry['stored_dtype'] == 'bfloat16' else np.dtype(entry['stored_dtype'])
+        start = data_start + entry['offset']
+        value = data[start:start + entry['nbytes']].view(stored).reshape(entry['shape'])
+        if entry['stored_dtype'] == 'bfloat16':
+            value = (value.astype(np.uint32) << 16).view(np.float32)
+        elif entry['stored_dtype'] != entry['dtype']:
+            value = value.astype(entry['dtype'])
+        weights[name] = value
+    return weights
+
+
+def _initial_weights_restore_ops(train_layers):
+    """Build the ops that restore the pretrained weights of the variables of the graph.
+
+    Called once by the model constructors, after the model is built, so that
+    `_load_initial_weights` only runs existing ops and leaves the graph
+    unchanged. Every global variable, but the global_step and those with a
+    scope in `train_layers`, gets a restore op reading it by name from the
+    checkpoint fed into the returned 'filename' placeholder. The restore ops
+    do not depend on each other, so any subset of them can be run.
+    Returns:
+        A dict with the 'filename' placeholder and the 'restore' ops by
+        variable name.
+    """
+    with tf.name_scope("load_initial_weights"):
+        filename = tf.placeholder(tf.string, [], name="filename")
+        restore = {}
+        for var in tf.global_variables():
+            op_name = var.op.name
+            if op_name == "global_step" or len([item for item in op_name.split("/") if item in train_layers]) != 0:
+                continue
+            value = io_ops.restore_v2(filename, [op_name], [""], [var.dtype.base_dtype])[0]
+            restore[op_name] = tf.assign(var, value).op
+    return {'filename': filename, 'restore': restore}
+
+
+def _load_initial_weights(session, weightPath, train_layers, restore_ops, num_threads=8, chunk_bytes=1 << 28):
+    """Restore the pretrained weights of a checkpoint into the variables of the graph.
+
+    Checkpoint variables with a scope in `train_layers`, and the global_step,
+    are not loaded. The checkpoint names are matched through the index of
+    the graph variables by name of `restore_ops`, built once by
+    `_initial_weights_restore_ops`. No op is added to the graph. The
+    memory-mapped values of `_read_checkpoint_tensors` (and of a flat weight
+    file) are fed into the initializers of their variables. They are
+    file-backed pages rather than numpy copies, though TF may copy unaligned
+    fed arrays for the duration of the run. The other weights are read and
+    assigned in C++ by the restore ops, in as many runs as it takes to keep
+    each under `chunk_bytes` of weights, so neither Python nor TF holds a
+    second copy of the whole checkpoint at once. A V1 checkpoint (the
+    pretrained checkpoints this repo downloads) takes a few runs, a V2 or
+    flat weight file a single one.
+    `weightPath` may also be a flat weight file of `convert_checkpoint_weights`.
+    Returns:
+        A dict with the names of the checkpoint variables that were
+        'loaded', 'skipped_train_layers' and 'missing' in the model, and the
+        (name, checkpoint shape, model shape) of the 'shape_mismatch'es.
+    """
+    if _is_flat_weights(weightPath):
+        flat_weights = load_flat_weights(weightPath)
+        var_to_shape_map = {name: list(value.shape) for name, value in flat_weights.items()}
+    else:
+        reader = pywrap_tensorflow.NewCheckpointReader(weightPath)
+        var_to_shape_map = reader.get_variable_to_shape_map()
+    graph_variables = {var.op.name: var for var in tf.global_variables() if var.op.name in restore_ops['restore']}
+
+    report = {'loaded': [], 'skipped_train_layers': [], 'missing': [], 'shape_mismatch': []}
+    for op_name in sorted(var_to_shape_map):
         # Do not load variable: global_step for finetuning
         if op_name == "global_step":
             continue
@@ -154,25 +1924,43 @@ def _load_initial_weights(session, weightPath, train_layers):
         op_name_list = op_name.split("/")
         # 判断两个列表是否有交集
         if len([item for item in op_name_list if item in train_layers]) != 0:
+            report['skipped_train_layers'].append(op_name)
             continue
 
-        try:
-
-            with tf.variable_scope("/".join(op_name.split("/")[0:-1]), reuse=True):
+        var = graph_variables.get(op_name)
+        if var is None:
+            report['missing'].append(op_name)
+            continue
+        if not var.shape.is_compatible_with(var_to_shape_map[op_name]):
+            report['shape_mismatch'].append((op_name, list(var_to_shape_map[op_name]), var.shape.as_list()))
+            continue
+        report['loaded'].append(op_name)
 
-                data = reader.get_tensor(op_name)
+    if _is_flat_weights(weightPath):
+        values = {name: flat_weights[name] for name in report['loaded']}
+    else:
+        values = _read_checkpoint_tensors(weightPath, report['loaded'], num_threads=num_threads)
+    fetches = [[graph_variables[name].initializer for name in values]]
+    feed_dicts = [{graph_variables[name].initial_value: value for name, value in values.items()}]
 
-                var = tf.get_variable(op_name.split("/")[-1], trainable=False)
-                session.run(var.assign(data))
+    # the weights that are not mapped are read by the restore ops, a chunk of them per run
+    run_bytes = 0
+    for name in report['loaded']:
+        if name in values:
+            continue
+        num_bytes = int(np.prod(var_to_shape_map[name])) * graph_variables[name].dtype.base_dtype.size
+        if run_bytes and run_bytes + num_bytes > chunk_bytes:
+            fetches.append([])
+            feed_dicts.append({})
+            run_bytes = 0
+        fetches[-1].append(restore_ops['restore'][name])
+        feed_dicts[-1][restore_ops['filename']] = weightPath
+        run_bytes += num_bytes
 
-        except ValueError:
+    for run_fetches, feed_dict in zip(fetches, feed_dicts):
+        session.run(run_fetches, feed_dict=feed_dict)
+    return report
 
-            tmp1 = list(op_name in str(item) for item in tf.global_variables())
-            tmp2 = np.sum([int(item) for item in tmp1])
-            if tmp2 == 0:
-                print("Don't be loaded: {}, cause: {}".format(op_name, "new model no need this variable."))
-            else:
-                print("Don't be loaded: {}, cause: {}".format(op_name, ValueError))
 
 def average_gradients(tower_grads):
     average_grads = []
@@ -189,25 +1977,243 @@ def average_gradients(tower_grads):
     return average_grads
 
 
+def _image_format(image_data):
+    """Return the format of an encoded image by looking at its magic bytes.
+
+    Only the formats `_decode_image` decodes are accepted.
+    """
+    if image_data[:8] == b'\x89PNG\r\n\x1a\n':
+        return b'png'
+    if image_data[:3] == b'\xff\xd8\xff':
+        return b'jpeg'
+    if image_data[:2] == b'BM':
+        return b'bmp'
+    raise ValueError("Unknown or unsupported image format")
+
+
+def _image_size(image_data, image_format):
+    """Return the (height, width) of an encoded image read from its header, without decoding it."""
+    try:
+        if image_format == b'png':
+            width, height = struct.unpack('>II', image_data[16:24])
+            return height, width
+        if image_format == b'bmp':
+            # OS/2 bitmaps have a 12 byte header with 16 bit sizes, top-down bitmaps a negative height
+            if struct.unpack('<I', image_data[14:18])[0] == 12:
+                width, height = struct.unpack('<HH', image_data[18:22])
+            else:
+                width, height = struct.unpack('<ii', image_data[18:26])
+            return abs(height), width
+
+        # walk the JPEG segments up to the start of frame
+        position = 2
+        while position + 9 <= len(image_data):
+            if image_data[position:position + 1] != b'\xff':
+                break
+            marker = ord(image_data[position + 1:position + 2])
+            if marker == 0xff:
+                position += 1
+            elif 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+                height, width = struct.unpack('>HH', image_data[position + 5:position + 9])
+                return height, width
+            elif marker == 0x01 or 0xd0 <= marker <= 0xd7:
+                position += 2
+            else:
+                position += 2 + struct.unpack('>H', image_data[position + 2:position + 4])[0]
+    except struct.error:
+        pass
+    raise ValueError("Truncated or corrupt {} header".format(image_format.decode("ascii")))
+
+
+def convert_to_tfrecord(txt_file, output_dir, num_shards=8, shuffle=True):
+    """Pack the images of a manifest into sharded TFRecord files.
+
+    Every image is stored still encoded, together with its label and size,
+    with `dataset_utils.image_to_tfexample`. The size is read from the image
+    header, nothing is decoded. Files that can not be read, or whose format
+    or header the input pipeline can not decode, are left out and reported.
+    Next to the shards an index file
+    is written, with one line per shard holding its path and its number of
+    records. The index can be passed as `txt_file` to ImageDataGenerator with
+    source='tfrecord'.
+
+    Args:
+        txt_file: Path to the image manifest (one "path label" per line).
+        output_dir: Directory the shards and the index are written to.
+        num_shards: Number of TFRecord files to split the images into.
+        shuffle: Whether to shuffle the images before writing them, so every
+            shard holds a mix of all classes.
+    Returns:
+        The path of the shard index file.
+    """
+    from nets import dataset_utils
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    img_paths = []
+    labels = []
+    with open(txt_file, 'r') as f:
+        for line in f:
+            items = line.split(' ')
+            img_paths.append(items[0])
+            labels.append(int(items[1]))
+
+    order = np.random.permutation(len(labels)) if shuffle else np.arange(len(labels))
+    name = os.path.splitext(os.path.basename(txt_file))[0]
+    index_path = os.path.join(output_dir, "{}-tfrecord.txt".format(name))
+
+    unreadable = []
+    with open(index_path, 'w') as index:
+        for shard_id, shard in enumerate(np.array_split(order, num_shards)):
+            shard_path = os.path.join(output_dir, "{}-{:05d}-of-{:05d}.tfrecord".format(name, shard_id, num_shards))
+            num_records = 0
+            with tf.python_io.TFRecordWriter(shard_path) as writer:
+                for i in shard:
+                    try:
+                        with open(img_paths[i], 'rb') as img_file:
+                            image_data = img_file.read()
+                        image_format = _image_format(image_data)
+                        height, width = _image_size(image_data, image_format)
+                    except (IOError, OSError, ValueError) as e:
+                        unreadable.append((img_paths[i], e))
+                        continue
+                    example = dataset_utils.image_to_tfexample(image_data, image_format, height, width, labels[i])
+                    writer.write(example.SerializeToString())
+                    num_records += 1
+            index.write("{} {}\n".format(os.path.abspath(shard_path), num_records))
+            print("Wrote {} images to {}".format(num_records, shard_path))
+
+    if unreadable:
+        print("left out {} unreadable images of {}:".format(len(unreadable), txt_file))
+        for path, error in unreadable:
+            print("  {}: {}".format(path, error))
+    return index_path
+
+
 def download_ckpt(url):
+    from nets import dataset_utils
     target_dir = os.path.join("./pre_trained_models/")
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
     dataset_utils.download_and_uncompress_tarball(url, target_dir)
 
 
+def _merge_stats(a, b):
+    """Merge two partial (num_pixels, mean, M2) aggregates of the RGB channels.
+
+    M2 is the sum of squared deviations from the mean. Merging is exact, in
+    any order (Chan et al.'s parallel variance).
+    """
+    count_a, mean_a, m2_a = a
+    count_b, mean_b, m2_b = b
+    count = count_a + count_b
+    if count == 0:
+        return a
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (float(count_b) / count)
+    m2 = m2_a + m2_b + delta ** 2 * (float(count_a) * count_b / count)
+    return count, mean, m2
+
+
+def _image_stats(img_paths):
+    """Aggregate the RGB pixels of some images, in a worker of `compute_dataset_stats`.
+
+    Returns:
+        The merged (num_pixels, mean, M2) aggregate of the images and the
+        number of images that could not be read.
+    """
+    import cv2
+    stats = (0, np.zeros(3), np.zeros(3))
+    num_unreadable = 0
+    for path in img_paths:
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            num_unreadable += 1
+            continue
+        pixels = image[:, :, ::-1].reshape(-1, 3).astype(np.float64)
+        mean = pixels.mean(axis=0)
+        stats = _merge_stats(stats, (len(pixels), mean, ((pixels - mean) ** 2).sum(axis=0)))
+    return stats, num_unreadable
+
+
+def compute_dataset_stats(txt_files, max_images=None, seed=0, num_workers=None, chunk_size=64):
+    """Compute the exact per-channel mean and std of the pixels of some manifests.
+
+    Every pixel counts once, so large images weigh more than small ones. A
+    pool of processes aggregates chunks of images, and the partial
+    aggregates are merged exactly (see `_merge_stats`). The result is cached
+    as JSON next to the first manifest, named after a hash of the contents
+    of all manifests and of the sampling settings, and is returned from
+    there on later calls.
+
+    Args:
+        txt_files: Paths to the image manifests (one "path label" per line).
+        max_images: If given, a random sample of that many images is used
+            instead of all of them, for very large datasets.
+        seed: Seed of the sample.
+        num_workers: Number of processes, defaults to the number of CPUs.
+        chunk_size: Number of images per task of a process.
+    Returns:
+        A dict with the RGB 'mean' and 'std', the 'num_pixels' and
+        'num_images' they were computed from and the 'path' of the cached
+        statistics. Pass the path (or the mean) as `mean` to
+        ImageDataGenerator.
+    """
+    sha = hashlib.sha1()
+    for txt_file in txt_files:
+        with open(txt_file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+    sha.update("{}-{}".format(max_images, seed).encode("utf-8"))
+    stats_path = "{}-stats-{}.json".format(os.path.splitext(txt_files[0])[0], sha.hexdigest()[:16])
+    if os.path.exists(stats_path):
+        return load_dataset_stats(stats_path)
+
+    img_paths = []
+    for txt_file in txt_files:
+        with open(txt_file, 'r') as f:
+            img_paths.extend(line.split(' ')[0] for line in f.readlines())
+    if max_images is not None and max_images < len(img_paths):
+        sample = np.random.RandomState(seed).choice(len(img_paths), max_images, replace=False)
+        img_paths = [img_paths[i] for i in np.sort(sample)]
+
+    print("computing the statistics of {} images ...".format(len(img_paths)))
+    chunks = [img_paths[i:i + chunk_size] for i in range(0, len(img_paths), chunk_size)]
+    stats = (0, np.zeros(3), np.zeros(3))
+    num_unreadable = 0
+    pool = multiprocessing.Pool(num_workers or multiprocessing.cpu_count())
+    try:
+        for chunk_stats, chunk_unreadable in pool.imap_unordered(_image_stats, chunks):
+            stats = _merge_stats(stats, chunk_stats)
+            num_unreadable += chunk_unreadable
+    finally:
+        pool.close()
+        pool.join()
+    if num_unreadable:
+        print("skipped {} unreadable images".format(num_unreadable))
+
+    num_pixels, mean, m2 = stats
+    result = {'mean': mean.tolist(),
+              'std': np.sqrt(m2 / max(num_pixels, 1)).tolist(),
+              'num_pixels': int(num_pixels),
+              'num_images': len(img_paths) - num_unreadable}
+    with open(stats_path + ".tmp", 'w') as f:
+        json.dump(result, f, indent=2)
+    os.rename(stats_path + ".tmp", stats_path)
+    return dict(result, path=stats_path)
+
+
+def load_dataset_stats(stats_path):
+    """Load the statistics written by `compute_dataset_stats`."""
+    with open(stats_path, 'r') as f:
+        return dict(json.load(f), path=stats_path)
+
+
 def compute_mean(train_path="./data/train.txt", validation_path="./data/validation.txt"):
-    count = 0
-    imgs_mean = np.zeros(shape=(3,), dtype=np.float32)
-    for filepath in [train_path, validation_path]:
-        with open(filepath, "r", encoding="utf-8") as f:
-            for line in f:
-                img = cv2.cvtColor(cv2.imread(line.split(" ")[0]), cv2.COLOR_BGR2RGB)
-                img = img.astype(np.float32)
-                imgs_mean += np.array([np.mean(img[:, :, 0]), np.mean(img[:, :, 1]), np.mean(img[:, :, 2])])
-                count += 1
-    IMAGES_MEAN = imgs_mean / count
-    print(IMAGES_MEAN)
+    """Print and return the exact RGB mean of the train and validation images."""
+    stats = compute_dataset_stats([train_path, validation_path])
+    print("mean: {}, std: {}, cached in {}".format(stats['mean'], stats['std'], stats['path']))
+    return stats['mean']
 
 
 if __name__ == "__main__":
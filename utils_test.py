@@ -0,0 +1,594 @@
+"""Tests for utils."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import os
+
+import numpy as np
+import tensorflow as tf
+
+import utils
+
+
+class ResolutionScheduleTest(tf.test.TestCase):
+
+    def testDefaultSize(self):
+        self.assertEqual(utils.parse_resolution_schedule('', default_size=224), [(0, 224)])
+
+    def testSortsTheStages(self):
+        self.assertEqual(utils.parse_resolution_schedule('800:224,0:128,400:160', default_size=224),
+                         [(0, 128), (400, 160), (800, 224)])
+
+    def testHasToStartAtStepZero(self):
+        with self.assertRaises(ValueError):
+            utils.parse_resolution_schedule('100:128,400:224', default_size=224)
+
+    def testMalformedSchedule(self):
+        for schedule in ['0-128', '0:large', '0:128,']:
+            with self.assertRaises(ValueError):
+                utils.parse_resolution_schedule(schedule, default_size=224)
+
+    def testResolutionStage(self):
+        schedule = [(0, 128), (400, 160), (800, 224)]
+        self.assertEqual([utils.resolution_stage(schedule, step) for step in [0, 399, 400, 799, 800, 10000]],
+                         [0, 0, 1, 1, 2, 2])
+
+
+class InputMonitorTest(tf.test.TestCase):
+
+    class _Generator(object):
+        def __init__(self):
+            self.batch_ready_times = collections.deque()
+
+    class _Session(object):
+        """Makes a batch ready at the given time during every step (None: none), like the stamp op of a pipeline."""
+        def __init__(self, generator, ready_times):
+            self.generator = generator
+            self.ready_times = list(ready_times)
+
+        def run(self, fetches, feed_dict=None):
+            ready_time = self.ready_times.pop(0)
+            if ready_time is not None:
+                self.generator.batch_ready_times.append(ready_time)
+            return fetches
+
+    class _SummaryWriter(object):
+        def __init__(self):
+            self.summaries = []
+
+        def add_summary(self, summary, step):
+            self.summaries.append((step, {value.tag: value.simple_value for value in summary.value}))
+
+    def _run_steps(self, monitor, step_times, ready_times, queued=()):
+        generator = self._Generator()
+        generator.batch_ready_times.extend(queued)
+        sess = self._Session(generator, ready_times)
+        # time.time() is read at the start and at the end of every step
+        clock = [t for step in step_times for t in step]
+        with tf.test.mock.patch.object(utils.time, 'time', side_effect=clock):
+            for _ in step_times:
+                monitor.run(sess, generator, 'fetch')
+
+    def testWaitFractionAndFillLevel(self):
+        monitor = utils.InputMonitor(input_bound_threshold=0.2)
+        # the first step finds a batch ready before it started, the second waits 0.5s of 1s for it
+        self._run_steps(monitor, step_times=[(1.0, 2.0), (2.0, 3.0)], ready_times=[None, 2.5], queued=[0.5])
+        writer = self._SummaryWriter()
+
+        self.assertAllClose(monitor.report(writer, step=7), 0.25)
+        step, values = writer.summaries[0]
+        self.assertEqual(step, 7)
+        self.assertAllClose(values['input/wait_fraction'], 0.25)
+        self.assertAllClose(values['input/prefetch_fill'], 0.5)
+        self.assertEqual(values['input/input_bound'], 1.0)
+
+    def testReportResetsTheInterval(self):
+        monitor = utils.InputMonitor(input_bound_threshold=0.2)
+        self._run_steps(monitor, step_times=[(0.0, 1.0)], ready_times=[0.9])
+        writer = self._SummaryWriter()
+        self.assertAllClose(monitor.report(writer, step=1), 0.9)
+        self.assertEqual(monitor.report(writer, step=2), 0.0)
+        self.assertEqual(writer.summaries[1][1]['input/input_bound'], 0.0)
+
+
+class SampleCacheTest(tf.test.TestCase):
+
+    def _image(self, value, size=4):
+        return np.full((size, size, 3), value, dtype=np.uint8)
+
+    def testLookupMissAndHit(self):
+        cache = utils.SampleCache(max_bytes=1000)
+        found, image = cache.lookup(b'a.jpg')
+        self.assertFalse(found)
+        self.assertEqual(image.shape, (0, 0, 3))
+
+        cache.insert(b'a.jpg', self._image(7))
+        found, image = cache.lookup(b'a.jpg')
+        self.assertTrue(found)
+        self.assertAllEqual(image, self._image(7))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def testEvictsLeastRecentlyUsedWithinBudget(self):
+        # every image takes 48 bytes, so three of them fit
+        cache = utils.SampleCache(max_bytes=150)
+        for key in [b'a', b'b', b'c']:
+            cache.insert(key, self._image(1))
+        cache.lookup(b'a')
+        cache.insert(b'd', self._image(1))
+
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.num_bytes, 144)
+        self.assertFalse(cache.lookup(b'b')[0])
+        for key in [b'a', b'c', b'd']:
+            self.assertTrue(cache.lookup(key)[0])
+
+    def testSkipsImagesLargerThanBudget(self):
+        cache = utils.SampleCache(max_bytes=40)
+        cache.insert(b'a', self._image(1))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.num_bytes, 0)
+
+    def testInsertCopiesTheImage(self):
+        cache = utils.SampleCache(max_bytes=1000)
+        image = self._image(1)
+        cache.insert(b'a', image)
+        image[:] = 2
+        self.assertAllEqual(cache.lookup(b'a')[1], self._image(1))
+
+
+class ImageHeaderTest(tf.test.TestCase):
+
+    def _encode(self, extension, height=5, width=7):
+        import cv2
+        image = np.random.RandomState(0).randint(0, 256, size=(height, width, 3)).astype(np.uint8)
+        return cv2.imencode(extension, image)[1].tobytes()
+
+    def testImageSize(self):
+        for extension, image_format in [('.jpg', b'jpeg'), ('.png', b'png'), ('.bmp', b'bmp')]:
+            image_data = self._encode(extension)
+            self.assertEqual(utils._image_format(image_data), image_format)
+            self.assertEqual(utils._image_size(image_data, image_format), (5, 7))
+
+    def testRejectsUnsupportedFormats(self):
+        with self.assertRaises(ValueError):
+            utils._image_format(b'GIF89a' + b'\0' * 16)
+
+    def testRejectsTruncatedHeaders(self):
+        for extension, image_format in [('.jpg', b'jpeg'), ('.png', b'png'), ('.bmp', b'bmp')]:
+            with self.assertRaises(ValueError):
+                utils._image_size(self._encode(extension)[:12], image_format)
+
+
+class ScanImageTest(tf.test.TestCase):
+
+    def _write(self, name, data):
+        path = os.path.join(self.get_temp_dir(), name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def _jpeg(self):
+        import cv2
+        image = np.random.RandomState(0).randint(0, 256, size=(5, 7, 3)).astype(np.uint8)
+        return cv2.imencode('.jpg', image)[1].tobytes()
+
+    def testJpegWithTrailerIsUsable(self):
+        path = self._write("trailer.jpg", self._jpeg() + b'camera trailer bytes')
+        self.assertEqual(utils._scan_image(path)[:3], (1, 5, 7))
+
+    def testTruncatedJpegIsUnusable(self):
+        data = self._jpeg()
+        path = self._write("truncated.jpg", data[:len(data) // 2])
+        self.assertEqual(utils._scan_image(path)[0], 0)
+
+    def testMissingFileIsUnusable(self):
+        self.assertEqual(utils._scan_image(os.path.join(self.get_temp_dir(), "missing.jpg")), (0, 0, 0, 0))
+
+
+class IndexLinesTest(tf.test.TestCase):
+
+    def _index(self, contents, chunk_size=1 << 24):
+        txt_file = os.path.join(self.get_temp_dir(), "manifest.txt")
+        with open(txt_file, 'wb') as f:
+            f.write(contents)
+        return list(utils._index_lines(txt_file, chunk_size=chunk_size))
+
+    def testTrailingNewline(self):
+        self.assertEqual(self._index(b"a.jpg 0\nbb.jpg 1\n"), [0, 8, 17])
+
+    def testNoTrailingNewline(self):
+        self.assertEqual(self._index(b"a.jpg 0\nbb.jpg 1"), [0, 8, 16])
+
+    def testEmptyFile(self):
+        self.assertEqual(self._index(b""), [0])
+
+    def testLinesAcrossChunks(self):
+        contents = b"a.jpg 0\nbb.jpg 1\nccc.jpg 2\n"
+        self.assertEqual(self._index(contents, chunk_size=5), self._index(contents))
+
+
+class SampleOrderTest(tf.test.TestCase):
+
+    def _generator(self, num_workers=1, worker_index=0, seed=3, start_position=0):
+        # only the attributes the index streams read, no pipeline is built
+        generator = utils.ImageDataGenerator.__new__(utils.ImageDataGenerator)
+        generator.num_workers = num_workers
+        generator.worker_index = worker_index
+        generator.seed = seed
+        generator.start_position = start_position
+        generator.repeat = True
+        return generator
+
+    def _dataset_stream(self, generator, num_samples, count):
+        with tf.Graph().as_default():
+            next_index = generator._index_dataset(num_samples, shuffle=True).make_one_shot_iterator().get_next()
+            with self.test_session() as sess:
+                return [int(sess.run(next_index)) for _ in range(count)]
+
+    def _batches_stream(self, generator, num_samples, count):
+        batches = generator._index_batches(num_samples, shuffle=True, batch_size=4)
+        stream = []
+        while len(stream) < count:
+            stream.extend(int(i) for i in next(batches))
+        return stream[:count]
+
+    def testSharesAreDisjointAndCoverTheEpoch(self):
+        num_samples = 11
+        for stream in [self._dataset_stream, self._batches_stream]:
+            for num_workers in [1, 2, 3, 5]:
+                shares = []
+                for worker_index in range(num_workers):
+                    generator = self._generator(num_workers, worker_index)
+                    shares.append(stream(generator, num_samples, generator._share_size(num_samples)))
+                self.assertEqual(sorted(sum(shares, [])), list(range(num_samples)))
+
+    def testStreamDependsOnlyOnTheSeed(self):
+        for stream in [self._dataset_stream, self._batches_stream]:
+            first = stream(self._generator(seed=3), 10, 30)
+            self.assertEqual(stream(self._generator(seed=3), 10, 30), first)
+            self.assertNotEqual(stream(self._generator(seed=4), 10, 30), first)
+            # every epoch is a new permutation of all samples
+            self.assertEqual(sorted(first[10:20]), list(range(10)))
+            self.assertNotEqual(first[10:20], first[:10])
+
+    def testStartPositionShiftsTheStream(self):
+        for stream in [self._dataset_stream, self._batches_stream]:
+            for num_workers, worker_index in [(1, 0), (3, 1)]:
+                full = stream(self._generator(num_workers, worker_index), 10, 20)
+                # 4 and 7 samples in: within the first epoch of the share and across its end
+                for start_position in [4, 7]:
+                    generator = self._generator(num_workers, worker_index, start_position=start_position)
+                    self.assertEqual(stream(generator, 10, 20 - start_position), full[start_position:])
+
+
+class InputStateTest(tf.test.TestCase):
+
+    def _checkpoint(self, step):
+        path = os.path.join(self.get_temp_dir(), "model-{}".format(step))
+        with open(path + ".index", 'w'):
+            pass
+        return path
+
+    def testRoundTrip(self):
+        path = self._checkpoint(1)
+        utils.save_input_state(path, np.int64(42), 1280)
+        self.assertEqual(utils.load_input_state(path), (42, 1280))
+
+    def testRemovesStatesOfRotatedCheckpoints(self):
+        paths = [self._checkpoint(step) for step in [10, 20, 30]]
+        utils.save_input_state(paths[0], 1, 10, last_checkpoints=paths[:1])
+        utils.save_input_state(paths[1], 1, 20, last_checkpoints=paths[:2])
+        # the saver rotated model-10 out, a restored saver does not know model-20
+        os.remove(paths[0] + ".index")
+        utils.save_input_state(paths[2], 1, 30, last_checkpoints=paths[2:])
+
+        self.assertFalse(os.path.exists(paths[0] + ".input.json"))
+        self.assertEqual(utils.load_input_state(paths[1]), (1, 20))
+        self.assertEqual(utils.load_input_state(paths[2]), (1, 30))
+
+    def testNoCheckpointToResume(self):
+        with self.assertRaises(ValueError):
+            utils.load_input_state(None)
+
+
+class ImageIndexTest(tf.test.TestCase):
+
+    def _generator(self, contents, records):
+        txt_file = os.path.join(self.get_temp_dir(), "manifest.txt")
+        with open(txt_file, 'w') as f:
+            f.write(contents)
+        index = np.zeros(len(records), dtype=utils.IMAGE_INDEX_DTYPE)
+        for i, name in enumerate(utils.IMAGE_INDEX_DTYPE.names):
+            index[name] = [record[i] for record in records]
+        index_path = utils._image_index_path(txt_file)
+        utils._save_image_index(index_path, index)
+
+        generator = utils.ImageDataGenerator.__new__(utils.ImageDataGenerator)
+        generator.txt_file = txt_file
+        generator.image_index = index_path
+        generator.img_out_size = 4
+        generator._read_txt_file()
+        return generator
+
+    def testDropsUnusableImagesAndKeepsSizes(self):
+        generator = self._generator("a.jpg 0\nb.jpg 1\nc.png 2\n", [(1, 4, 4, 10), (0, 0, 0, 3), (2, 6, 8, 10)])
+        generator._apply_image_index()
+        self.assertEqual(generator.img_paths, ['a.jpg', 'c.png'])
+        self.assertEqual(generator.labels, [0, 2])
+        self.assertEqual(generator.image_sizes, [[4, 4], [6, 8]])
+
+    def testRejectsIndexOfEditedManifest(self):
+        generator = self._generator("a.jpg 0\nb.jpg 1\n", [(1, 4, 4, 10), (1, 4, 4, 10)])
+        # same number of lines, other contents
+        with open(generator.txt_file, 'w') as f:
+            f.write("b.jpg 1\na.jpg 0\n")
+        generator._read_txt_file()
+        with self.assertRaises(ValueError):
+            generator._apply_image_index()
+
+
+class DatasetStatsTest(tf.test.TestCase):
+
+    def _stats(self, pixels):
+        mean = pixels.mean(axis=0)
+        return len(pixels), mean, ((pixels - mean) ** 2).sum(axis=0)
+
+    def testMergeIsExact(self):
+        pixels = np.random.RandomState(0).uniform(0, 255, size=(1000, 3))
+        parts = [pixels[:1], pixels[1:400], pixels[400:]]
+        merged = (0, np.zeros(3), np.zeros(3))
+        for part in parts:
+            merged = utils._merge_stats(merged, self._stats(part))
+
+        count, mean, m2 = merged
+        self.assertEqual(count, 1000)
+        self.assertAllClose(mean, pixels.mean(axis=0))
+        self.assertAllClose(m2 / count, pixels.var(axis=0))
+
+    def testMergeOrderDoesNotMatter(self):
+        pixels = np.random.RandomState(1).uniform(0, 255, size=(100, 3))
+        a, b = self._stats(pixels[:30]), self._stats(pixels[30:])
+        for x, y in zip(utils._merge_stats(a, b), utils._merge_stats(b, a)):
+            self.assertAllClose(x, y)
+
+    def testMergeWithEmpty(self):
+        empty = (0, np.zeros(3), np.zeros(3))
+        self.assertEqual(utils._merge_stats(empty, empty)[0], 0)
+        stats = self._stats(np.arange(30, dtype=np.float64).reshape(10, 3))
+        for x, y in zip(utils._merge_stats(empty, stats), stats):
+            self.assertAllClose(x, y)
+
+    def testImageStats(self):
+        import cv2
+        rgb = np.random.RandomState(2).randint(0, 256, size=(2, 5, 7, 3)).astype(np.uint8)
+        paths = []
+        for i, image in enumerate(rgb):
+            paths.append(os.path.join(self.get_temp_dir(), "{}.png".format(i)))
+            cv2.imwrite(paths[-1], image[:, :, ::-1])
+        paths.append(os.path.join(self.get_temp_dir(), "missing.png"))
+
+        (count, mean, m2), num_unreadable = utils._image_stats(paths)
+        pixels = rgb.reshape(-1, 3).astype(np.float64)
+        self.assertEqual(num_unreadable, 1)
+        self.assertEqual(count, len(pixels))
+        self.assertAllClose(mean, pixels.mean(axis=0))
+        self.assertAllClose(m2 / count, pixels.var(axis=0))
+
+
+class CheckpointIndexTest(tf.test.TestCase):
+
+    def _save_checkpoint(self, num_variables=200):
+        # enough long names for the index to span several table blocks
+        values = {}
+        with tf.Graph().as_default():
+            for i in range(num_variables):
+                name = "scope_{}/conv_{:03d}/weights".format(i % 3, i)
+                values[name] = np.random.RandomState(i).uniform(size=(i % 5 + 1, 3)).astype(np.float32)
+                tf.Variable(values[name], name=name)
+            values['global_step'] = np.int64(7)
+            tf.Variable(values['global_step'], name='global_step')
+            with self.test_session() as sess:
+                sess.run(tf.global_variables_initializer())
+                path = tf.train.Saver(write_version=tf.train.SaverDef.V2).save(
+                    sess, os.path.join(self.get_temp_dir(), "model.ckpt"))
+        return path, values
+
+    def testReadVarint(self):
+        self.assertEqual(utils._read_varint(b'\x00', 0), (0, 1))
+        self.assertEqual(utils._read_varint(b'\x7f', 0), (127, 1))
+        self.assertEqual(utils._read_varint(b'\xff\xac\x02', 1), (300, 3))
+        self.assertEqual(utils._read_varint(b'\x80\x80\x80\x80\x10', 0), (1 << 32, 5))
+
+    def testReadTableBlock(self):
+        # "abc" -> "1", then "abd" sharing two bytes of it -> "22", one restart at 0
+        block = b'\x00\x03\x01abc1' + b'\x02\x01\x02d22' + b'\x00\x00\x00\x00' + b'\x01\x00\x00\x00'
+        data = b'pad' + block + b'\x00' + b'crc!'
+        self.assertEqual(utils._read_table_block(data, 3, len(block)), [(b'abc', b'1'), (b'abd', b'22')])
+
+        compressed = b'pad' + block + b'\x01' + b'crc!'
+        with self.assertRaises(ValueError):
+            utils._read_table_block(compressed, 3, len(block))
+
+    def testReadBundleIndex(self):
+        path, values = self._save_checkpoint()
+        entries, num_shards = utils._read_bundle_index(path)
+
+        self.assertEqual(num_shards, 1)
+        self.assertEqual(set(entries), set(values))
+        for name, value in values.items():
+            self.assertEqual([dim.size for dim in entries[name].shape.dim], list(np.shape(value)))
+            self.assertEqual(tf.as_dtype(entries[name].dtype).as_numpy_dtype, np.asarray(value).dtype)
+
+    def testReadCheckpointTensors(self):
+        try:
+            import crc32c
+        except ImportError:
+            self.skipTest("the crc32c package is needed to map the tensors")
+        path, values = self._save_checkpoint(num_variables=20)
+        mapped = utils._read_checkpoint_tensors(path, sorted(values), num_threads=4, chunk_bytes=16)
+
+        self.assertEqual(set(mapped), set(values))
+        for name, value in values.items():
+            self.assertAllEqual(mapped[name], value)
+
+    def testReadCheckpointTensorsOfCorruptCheckpoint(self):
+        try:
+            import crc32c
+        except ImportError:
+            self.skipTest("the crc32c package is needed to map the tensors")
+        path, values = self._save_checkpoint(num_variables=20)
+        entry = utils._read_bundle_index(path)[0]['scope_1/conv_004/weights']
+        with open(path + ".data-00000-of-00001", 'r+b') as f:
+            f.seek(entry.offset)
+            byte = f.read(1)
+            f.seek(entry.offset)
+            f.write(bytes(bytearray([ord(byte) ^ 0xff])))
+        with self.assertRaises(ValueError):
+            utils._read_checkpoint_tensors(path, sorted(values))
+
+    def testReadCheckpointTensorsOfV1Checkpoint(self):
+        with tf.Graph().as_default():
+            tf.Variable(np.ones(3, dtype=np.float32), name='weights')
+            with self.test_session() as sess:
+                sess.run(tf.global_variables_initializer())
+                path = tf.train.Saver(write_version=tf.train.SaverDef.V1).save(
+                    sess, os.path.join(self.get_temp_dir(), "model_v1.ckpt"), write_meta_graph=False)
+        self.assertEqual(utils._read_checkpoint_tensors(path, ['weights']), {})
+
+
+class FlatWeightsTest(tf.test.TestCase):
+
+    def _save_checkpoint(self):
+        rng = np.random.RandomState(0)
+        # magnitudes within the normal range of float16
+        weights = rng.uniform(0.01, 4.0, size=(3, 3, 3, 8)) * rng.choice([-1.0, 1.0], size=(3, 3, 3, 8))
+        values = {'conv/weights': weights.astype(np.float32),
+                  'conv/biases': (rng.uniform(0.01, 1.0, size=7) * rng.choice([-1.0, 1.0], size=7)).astype(np.float32),
+                  'global_step': np.int64(5)}
+        with tf.Graph().as_default():
+            for name, value in values.items():
+                tf.Variable(value, name=name)
+            with self.test_session() as sess:
+                sess.run(tf.global_variables_initializer())
+                # a single-file V1 checkpoint, like the pretrained ones
+                path = tf.train.Saver(write_version=tf.train.SaverDef.V1).save(
+                    sess, os.path.join(self.get_temp_dir(), "model.ckpt"), write_meta_graph=False)
+        return path, values
+
+    def testRoundTrip(self):
+        path, values = self._save_checkpoint()
+        weights_path = utils.convert_checkpoint_weights(path, os.path.join(self.get_temp_dir(), "model.weights"))
+        self.assertTrue(utils._is_flat_weights(weights_path))
+        self.assertFalse(utils._is_flat_weights(path))
+
+        header, data_start = utils._read_flat_weights_header(weights_path)
+        self.assertEqual(header['source'], utils._checkpoint_fingerprint(path))
+        self.assertEqual(header['storage_dtype'], 'float32')
+        self.assertEqual(data_start % utils.FLAT_WEIGHTS_ALIGNMENT, 0)
+        for entry in header['tensors'].values():
+            self.assertEqual(entry['offset'] % utils.FLAT_WEIGHTS_ALIGNMENT, 0)
+
+        weights = utils.load_flat_weights(weights_path)
+        self.assertEqual(set(weights), set(values))
+        for name, value in values.items():
+            self.assertEqual(weights[name].dtype, np.asarray(value).dtype)
+            self.assertAllEqual(weights[name], value)
+            self.assertEqual(weights[name].ctypes.data % utils.FLAT_WEIGHTS_ALIGNMENT, 0)
+
+    def testHalfPrecisionErrorBounds(self):
+        path, values = self._save_checkpoint()
+        # round to nearest: at most half a unit in the last place of the 11 and 8 bit significands
+        for storage_dtype, max_relative_error in [('float16', 2.0 ** -11), ('bfloat16', 2.0 ** -8)]:
+            weights_path = utils.convert_checkpoint_weights(
+                path, os.path.join(self.get_temp_dir(), storage_dtype + ".weights"), storage_dtype=storage_dtype)
+            weights = utils.load_flat_weights(weights_path)
+
+            self.assertEqual(utils._read_flat_weights_header(weights_path)[0]['storage_dtype'], storage_dtype)
+            self.assertAllEqual(weights['global_step'], values['global_step'])
+            for name in ['conv/weights', 'conv/biases']:
+                self.assertEqual(weights[name].dtype, np.float32)
+                relative_error = np.abs(weights[name] - values[name]) / np.abs(values[name])
+                self.assertLessEqual(relative_error.max(), max_relative_error)
+
+    def testInvalidStorageDtype(self):
+        path, _ = self._save_checkpoint()
+        with self.assertRaises(ValueError):
+            utils.convert_checkpoint_weights(path, storage_dtype='int8')
+
+    def testNotAFlatWeightFile(self):
+        path, _ = self._save_checkpoint()
+        with self.assertRaises(ValueError):
+            utils.load_flat_weights(path)
+
+
+class LoadInitialWeightsTest(tf.test.TestCase):
+
+    def _save_checkpoint(self, values, write_version, name):
+        with tf.Graph().as_default():
+            for var_name, value in values.items():
+                tf.Variable(value, name=var_name)
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                return tf.train.Saver(write_version=write_version).save(
+                    sess, os.path.join(self.get_temp_dir(), name), write_meta_graph=False)
+
+    def testLoadAddsNoOps(self):
+        rng = np.random.RandomState(0)
+        values = {'conv/weights': rng.uniform(size=(3, 3, 3, 8)).astype(np.float32),
+                  'conv/biases': rng.uniform(size=8).astype(np.float32),
+                  'block/conv/weights': rng.uniform(size=(1, 1, 8, 8)).astype(np.float32),
+                  'fc/weights': rng.uniform(size=(8, 2)).astype(np.float32)}
+        for write_version, name in [(tf.train.SaverDef.V1, "model_v1.ckpt"), (tf.train.SaverDef.V2, "model_v2.ckpt")]:
+            path = self._save_checkpoint(values, write_version, name)
+            with tf.Graph().as_default() as graph:
+                for var_name, value in values.items():
+                    tf.Variable(tf.zeros(value.shape), name=var_name)
+                restore_ops = utils._initial_weights_restore_ops(['fc'])
+                with tf.Session() as sess:
+                    sess.run(tf.global_variables_initializer())
+                    num_ops = len(graph.get_operations())
+                    # a chunk smaller than a tensor, so the V1 weights take a run each
+                    utils._load_initial_weights(sess, path, ['fc'], restore_ops, chunk_bytes=16)
+                    self.assertEqual(len(graph.get_operations()), num_ops)
+
+                    loaded = sess.run({var.op.name: var for var in tf.global_variables()})
+            for var_name in ['conv/weights', 'conv/biases', 'block/conv/weights']:
+                self.assertAllEqual(loaded[var_name], values[var_name])
+            self.assertAllEqual(loaded['fc/weights'], np.zeros((8, 2)))
+
+    def testReport(self):
+        rng = np.random.RandomState(1)
+        values = {'conv/weights': rng.uniform(size=(3, 3, 3, 4)).astype(np.float32),
+                  'conv/biases': rng.uniform(size=4).astype(np.float32),
+                  'aux/weights': rng.uniform(size=(4, 4)).astype(np.float32),
+                  'fc/weights': rng.uniform(size=(4, 1000)).astype(np.float32),
+                  'logits/weights': rng.uniform(size=(4, 1000)).astype(np.float32),
+                  'global_step': np.int64(9)}
+        path = self._save_checkpoint(values, tf.train.SaverDef.V1, "report.ckpt")
+        with tf.Graph().as_default():
+            # no aux layer, an fc layer of another shape and new logits trained from scratch
+            conv_weights = tf.Variable(tf.zeros((3, 3, 3, 4)), name='conv/weights')
+            conv_biases = tf.Variable(tf.zeros(4), name='conv/biases')
+            fc_weights = tf.Variable(tf.zeros((4, 2)), name='fc/weights')
+            logits_weights = tf.Variable(tf.zeros((4, 2)), name='logits/weights')
+            restore_ops = utils._initial_weights_restore_ops(['logits'])
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                report = utils._load_initial_weights(sess, path, ['logits'], restore_ops)
+                loaded = sess.run([conv_weights, conv_biases, fc_weights, logits_weights])
+
+        self.assertEqual(report['loaded'], ['conv/biases', 'conv/weights'])
+        self.assertEqual(report['skipped_train_layers'], ['logits/weights'])
+        self.assertEqual(report['missing'], ['aux/weights'])
+        self.assertEqual(report['shape_mismatch'], [('fc/weights', [4, 1000], [4, 2])])
+        self.assertAllEqual(loaded[0], values['conv/weights'])
+        self.assertAllEqual(loaded[1], values['conv/biases'])
+        self.assertAllEqual(loaded[2], np.zeros((4, 2)))
+        self.assertAllEqual(loaded[3], np.zeros((4, 2)))
+
+
+if __name__ == '__main__':
+    tf.test.main()